@@ -6,13 +6,33 @@ import plotly.express as px
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from collections import Counter
+from functools import lru_cache
 
 from utils.auth import get_supabase_admin_client
+from utils.deletion import delete_records
+from utils.explain import EXPLANATIONS
+from utils.data import (
+    fetch_children_summary, fetch_heatmaps, fetch_results_page, fetch_stage_summary, get_children, invalidate_user_cache
+)
+from utils.similarity import similar_drawings
 from classes_def import stage_insights, stages_info
 
+def build_simple_stage_info() -> dict:
+    """Maps simplified stage names to their (stages_info key, description)."""
+    simple_stage_info = {}
+    for key, desc in stages_info.items():
+        match = re.search(r"[A-Za-z\s]+(?:Art|Stage|Age|Reasoning)", key)
+        if match:
+            simple_stage_info[match.group(0).strip()] = (key, desc)
+    return simple_stage_info
+
+# Built once at import instead of on every render
+simple_stage_info = build_simple_stage_info()
+
 def is_valid_uuid(val):
     return bool(re.match(r'^[0-9a-fA-F\-]{36}$', val))
 
+@lru_cache(maxsize=None)
 def extract_simple_stage_name(stage: str) -> str:
     """Cleans up a prediction string to match stage_insights keys."""
     stage = re.sub(r'[^\w\s]', '', stage)
@@ -23,6 +43,24 @@ def extract_simple_stage_name(stage: str) -> str:
             return key
     return stage
 
+def format_record(r: dict) -> dict:
+    try:
+        dt_utc = datetime.fromisoformat(r["created_at"])
+        dt_pht = dt_utc.astimezone(ZoneInfo("Asia/Manila"))
+        created_str = dt_pht.strftime("%b %d, %Y %I:%M %p")
+    except:
+        created_str = "Invalid date"
+
+    return {
+        "id": r["id"],
+        "image_path": r["image_path"],
+        "thumbnail_path": r.get("thumbnail_path") or r["image_path"],
+        "prediction": r["prediction"],
+        "confidence": r["confidence"],
+        "image_hash": r.get("image_hash"),
+        "created_at_str": created_str
+    }
+
 def render_child_records(child_id: str):
     if not child_id or not is_valid_uuid(child_id):
         st.error("Invalid or missing child ID.")
@@ -31,59 +69,33 @@ def render_child_records(child_id: str):
     supabase_admin = get_supabase_admin_client()
     user_id = st.session_state['user']['id']
 
-    child_resp = supabase_admin.table("children").select("name").eq("id", child_id).eq("user_id", user_id).execute()
-    if not child_resp.data:
+    child = next((c for c in get_children(supabase_admin, user_id) if c["id"] == child_id), None)
+    if child is None:
         st.error("Child record not found or access denied.")
         return
 
-    child_name = child_resp.data[0]["name"]
+    child_name = child["name"]
     st.markdown(f"<h5 style='text-align: center;'>Records for {child_name}</h5>", unsafe_allow_html=True)
 
     if st.button("⬅️ Back to Analyze"):
         st.session_state.pop('selected_child_id', None)
+        st.session_state.pop(f"records_pages_{child_id}", None)
         st.rerun()
 
-    results_resp = supabase_admin.table("results").select("*").eq("child_id", child_id).order("created_at", desc=True).execute()
-    results = results_resp.data or []
+    # Summary and chart come from a small server-side aggregate, not the full history
+    stage_summary = fetch_stage_summary(supabase_admin, child_id)
 
-    if not results:
+    if not stage_summary:
         st.markdown("<h6 style='text-align: center;'>No analysis records found for this child.</h6>", unsafe_allow_html=True)
         if st.button("⬅️ Back to Analyze", key="back_bottom"):
             st.session_state.pop('selected_child_id', None)
             st.rerun()
         return
 
-    # Format records
-    records_for_chart = []
-    for r in results:
-        try:
-            dt_utc = datetime.fromisoformat(r["created_at"])
-            dt_pht = dt_utc.astimezone(ZoneInfo("Asia/Manila"))
-            created_str = dt_pht.strftime("%b %d, %Y %I:%M %p")
-            created_date = dt_pht.date()
-        except:
-            created_str = "Invalid date"
-            created_date = None
-
-        records_for_chart.append({
-            "id": r["id"],
-            "image_path": r["image_path"],
-            "prediction": r["prediction"],
-            "confidence": r["confidence"],
-            "created_at_str": created_str,
-            "created_date": created_date
-        })
-
-    # Build simplified mapping for stage descriptions
-    simple_stage_info = {}
-    for key, desc in stages_info.items():
-        match = re.search(r"[A-Za-z\s]+(?:Art|Stage|Age|Reasoning)", key)
-        if match:
-            simple_name = match.group(0).strip()
-            simple_stage_info[simple_name] = (key, desc)
-
     # Generate summary
-    pred_counts = Counter(r['prediction'] for r in records_for_chart)
+    pred_counts = Counter()
+    for row in stage_summary:
+        pred_counts[row["prediction"]] += row["count"]
     if pred_counts:
         total = sum(pred_counts.values())
         summary_lines = [f"This child has {total} analyzed drawing(s) categorized into:"]
@@ -115,14 +127,12 @@ def render_child_records(child_id: str):
         st.markdown("<p>No predictions to summarize.</p>")
 
     # Chart
-    df_chart = pd.DataFrame([
-        {"Date": r["created_date"], "Prediction": r["prediction"]}
-        for r in records_for_chart if r["created_date"]
+    pred_progress = pd.DataFrame([
+        {"Date": row["day"], "Prediction": row["prediction"], "Count": row["count"]}
+        for row in stage_summary if row["day"]
     ])
 
-    if not df_chart.empty:
-        pred_progress = df_chart.groupby(["Date", "Prediction"]).size().reset_index(name='Count')
-
+    if not pred_progress.empty:
         fig = px.line(
             pred_progress,
             x="Date",
@@ -152,28 +162,75 @@ def render_child_records(child_id: str):
     st.markdown("---")
     st.markdown(f"<h5>Review {child_name}'s Records Below</h5>", unsafe_allow_html=True)
 
-    for record in records_for_chart:
+    # Records are loaded a page at a time; "Load More" fetches the next page after the cursor.
+    # The write-behind queue drops the cached children summary after each flush, so a changed
+    # record count means rows were added or removed since: start again from the first page.
+    pages_key = f"records_pages_{child_id}"
+    record_count = next(
+        (c["record_count"] for c in fetch_children_summary(supabase_admin, user_id) if c["id"] == child_id), None
+    )
+    if pages_key in st.session_state and st.session_state[pages_key].get("record_count") != record_count:
+        st.session_state.pop(pages_key)
+    if pages_key not in st.session_state:
+        rows, cursor = fetch_results_page(supabase_admin, child_id)
+        st.session_state[pages_key] = {"rows": rows, "cursor": cursor, "record_count": record_count}
+    loaded = st.session_state[pages_key]
+
+    # Stored Grad-CAM overlays for the loaded records; only hashes without one yet are re-checked
+    heatmaps = loaded.setdefault("heatmaps", {})
+    pending = {r.get("image_hash") for r in loaded["rows"]} - heatmaps.keys() - {None}
+    if pending and EXPLANATIONS:
+        heatmaps.update(fetch_heatmaps(supabase_admin, user_id, pending))
+
+    for record in (format_record(r) for r in loaded["rows"]):
         cols = st.columns([2, 2, 1])
         with cols[0]:
             st.markdown(f"<small style='color:gray;'>Date Analyzed: {record['created_at_str']}</small>", unsafe_allow_html=True)
-            st.image(record["image_path"], width=250)
+            # Thumbnails keep the page light; the full drawing is only fetched when opened
+            st.image(record["thumbnail_path"], width=250)
+            st.markdown(f"<small><a href='{html.escape(record['image_path'])}' target='_blank'>View full size</a></small>", unsafe_allow_html=True)
+            if record["image_hash"] in heatmaps:
+                with st.expander("🔍 Why this stage?"):
+                    st.image(heatmaps[record["image_hash"]], width=250)
+                    st.caption("Warmer areas influenced the predicted stage the most.")
         with cols[1]:
             st.markdown(f"**Prediction:** {record['prediction']}")
             st.markdown(f"**Confidence:** {record['confidence']:.2f}%")
+            if st.button("Find Similar", key=f"similar_{record['id']}"):
+                st.session_state["similar_record_id"] = record["id"]
         with cols[2]:
             delete_key = f"delete_{record['id'] or record['created_at_str']}"
             if st.button("Delete Record", key=delete_key):
                 try:
-                    delete_resp = supabase_admin.table("results").delete().eq("id", record["id"]).execute()
-                    if delete_resp.data:
+                    if delete_records(supabase_admin, user_id, [record["id"]]):
+                        invalidate_user_cache(user_id, "children_summary", "embeddings")
+                        loaded["rows"] = [r for r in loaded["rows"] if r["id"] != record["id"]]
                         st.success("Record deleted successfully.")
                         st.rerun()
                     else:
                         st.error("Failed to delete the record.")
                 except Exception as e:
                     st.error(f"Error: {e}")
+
+        # Nearest drawings across all of this user's children, from the in-memory embedding index
+        if st.session_state.get("similar_record_id") == record["id"]:
+            matches = similar_drawings(supabase_admin, user_id, record["id"])
+            if not matches:
+                st.caption("No similar drawings found. Drawings analyzed before similarity search was added have no embedding yet.")
+            for col, (match, similarity, duplicate) in zip(st.columns(max(len(matches), 1)), matches):
+                with col:
+                    st.image(match.get("thumbnail_path") or match["image_path"], use_container_width=True)
+                    label = f"{match['child_name']} · {extract_simple_stage_name(match['prediction'])} · {similarity:.0%}"
+                    st.caption(label + (" · ⚠️ possible duplicate" if duplicate else ""))
         st.markdown("---")
 
+    if loaded["cursor"] and st.button("Load More", use_container_width=True):
+        rows, cursor = fetch_results_page(supabase_admin, child_id, loaded["cursor"])
+        loaded["rows"] += rows
+        loaded["cursor"] = cursor
+        st.rerun()
+
     if st.button("⬅️ Back to Analyze", key="back_bottom"):
         st.session_state.pop('selected_child_id', None)
+        st.session_state.pop(pages_key, None)
         st.rerun()
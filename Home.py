@@ -7,12 +7,17 @@ st.set_page_config(page_title="Drawee", page_icon="🖼️")
 # from tensorflow.keras.models import load_model
 from utils.auth import login, signup, is_authenticated, logout, get_supabase_client
 from classes_def import stages_info
+from utils.models import warm_up_in_background
+from utils.data import get_display_name, invalidate_user_cache
 
 
 # --- Connect to Supabase ---
 supabase = get_supabase_client()
 # supabase_admin = get_supabase_admin_client()
 
+# Start loading the models as soon as the server serves its first page
+warm_up_in_background()
+
 # --- Streamlit UI ---
 
 # --- Custom CSS Styling ---
@@ -98,8 +103,7 @@ if is_authenticated():
     # st.success(f"Welcome back, {st.session_state['user']['email']}!")
     # With this block:
     user_id = st.session_state['user']['id']
-    profile = supabase.table("profiles").select("display_name").eq("id", user_id).single().execute()
-    display_name = profile.data["display_name"] if profile.data else st.session_state['user']['email']
+    display_name = get_display_name(supabase, user_id, st.session_state['user']['email'])
     st.success(f"Welcome back, {display_name}!")
 
     if st.button("Analyze Drawings", use_container_width=True):
@@ -148,6 +152,7 @@ else:
                         "id": user_id,
                         "display_name": display_name.strip()
                     }).execute()
+                    invalidate_user_cache(user_id, "profile")
 
                     if insert_result.error is None and insert_result.data is not None:
                         st.success("Account created! Logging you in...")
@@ -0,0 +1,243 @@
+"""
+Benchmark the analyze pipeline without Supabase, network or the trained weights.
+
+    python -m benchmarks.bench_analyze --output benchmarks/baseline.json
+    python -m benchmarks.bench_analyze --compare benchmarks/baseline.json
+
+Synthetic drawings at several resolutions are decoded and resized. Randomly initialised
+ResNet-50 and Xception stand-ins with the app's input and output shapes, and their fused
+graph, are put into the model registry, so the app's own code is what gets timed across
+batch sizes: model_inputs, each backbone, predict_ensemble averaged and fused (with and
+without embeddings), predict_adaptive when every drawing exits early and when none does,
+and predict_serving as configured. Each stage reports p50/p95/p99 latency and throughput. --compare flags any stage whose
+p50 regressed by more than --tolerance against an earlier results file.
+"""
+import argparse
+import io
+import json
+import platform
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import cv2
+from PIL import Image
+
+from classes_def import classes
+from utils.backends import KerasBackend
+from utils.models import INPUT_SHAPE
+from utils.preprocess import model_inputs, stack_batch
+from utils.storage import decode_image
+
+RESOLUTIONS = {"vga": (640, 480), "hd": (1920, 1080), "phone-12mp": (4032, 3024)}
+BATCH_SIZES = (1, 4, 16)
+
+
+def synthetic_drawing(size, seed: int) -> bytes:
+    """
+    JPEG bytes of a crayon-like drawing: random coloured strokes and shapes on white paper.
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    thickness = max(2, w // 150)
+    for _ in range(40):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        pts = rng.integers(0, [w, h], (int(rng.integers(2, 8)), 2)).astype(np.int32)
+        cv2.polylines(img, [pts], False, color, thickness)
+    for _ in range(8):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = tuple(int(c) for c in rng.integers(0, [w, h]))
+        cv2.circle(img, center, int(rng.integers(10, max(11, h // 6))), color, -1)
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def stand_in_models() -> dict:
+    from tensorflow import keras
+
+    def classifier(backbone_fn, name):
+        backbone = backbone_fn(weights=None, include_top=False, input_shape=INPUT_SHAPE)
+        x = keras.layers.GlobalAveragePooling2D()(backbone.output)
+        out = keras.layers.Dense(len(classes), activation="softmax")(x)
+        return keras.Model(backbone.input, out, name=name)
+
+    return {
+        "resnet": classifier(keras.applications.ResNet50, "resnet"),
+        "xception": classifier(keras.applications.Xception, "xception"),
+    }
+
+
+class StandInBackend(KerasBackend):
+    """
+    KerasBackend around an in-memory model instead of a weights file.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._features_model = None
+        self._features_lock = threading.Lock()
+
+
+def register_stand_ins(models: dict):
+    """
+    Put the stand-ins into the process-wide registry, so get_model() serves them.
+    """
+    import utils.models
+
+    for name, model in models.items():
+        utils.models._registry[name] = {
+            "name": name,
+            "model": StandInBackend(model),
+            "path": None,
+            "backend": KerasBackend.name,
+            "load_seconds": 0.0,
+            "warmup_seconds": 0.0,
+            "rss_mb": 0.0,
+        }
+
+
+@contextmanager
+def overridden(module, **values):
+    """
+    Temporarily replace module-level settings, e.g. to force one serving mode.
+    """
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def measure(fn, repeat: int, warmup: int = 2, items: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "throughput_per_s": round(items * 1000 / float(np.mean(samples)), 2),
+        "repeat": repeat,
+    }
+
+
+def run(repeat: int) -> dict:
+    results = {}
+
+    # --- Decode and resize ---
+    for label, size in RESOLUTIONS.items():
+        data = synthetic_drawing(size, seed=0)
+        decoded = np.asarray(decode_image(io.BytesIO(data)))
+        results[f"decode/{label}"] = measure(lambda: np.asarray(decode_image(io.BytesIO(data))), repeat)
+        results[f"resize/{label}"] = measure(lambda: stack_batch([decoded]), repeat)
+
+    # --- Models ---
+    import utils.inference as inference
+    from utils.ensemble import build_fused_model
+
+    models = stand_in_models()
+    register_stand_ins({**models, "ensemble": build_fused_model(dict(models))})
+    for batch_size in BATCH_SIZES:
+        batch = np.random.default_rng(batch_size).integers(0, 256, (batch_size,) + INPUT_SHAPE, dtype=np.uint8)
+        results[f"model_inputs/b{batch_size}"] = measure(
+            lambda: model_inputs(batch, inference.ENSEMBLE), repeat, items=batch_size
+        )
+        inputs = model_inputs(batch, inference.ENSEMBLE)
+
+        for name in models:
+            results[f"predict/{name}/b{batch_size}"] = measure(
+                lambda: inference._predict_model(name, inputs[name], {}), repeat, items=batch_size
+            )
+
+        for mode, fused in (("averaged", False), ("fused", True)):
+            with overridden(inference, fused_model_available=lambda: fused):
+                results[f"ensemble/{mode}/b{batch_size}"] = measure(
+                    lambda: inference.predict_ensemble(batch), repeat, items=batch_size
+                )
+                results[f"ensemble/{mode}+embedding/b{batch_size}"] = measure(
+                    lambda: inference.predict_ensemble(batch, features={}), repeat, items=batch_size
+                )
+
+        # Thresholds that every / no drawing clears: the cheapest and the costliest early-exit batch
+        for label, threshold in (("all", 0.0), ("none", 1.01)):
+            with overridden(inference, EARLY_EXIT_MIN_PROB=threshold, EARLY_EXIT_MIN_MARGIN=0.0, EARLY_EXIT_AUDIT_RATE=0.0):
+                results[f"early_exit/{label}/b{batch_size}"] = measure(
+                    lambda: inference.predict_adaptive(batch, features={}), repeat, items=batch_size
+                )
+
+        results[f"serving/b{batch_size}"] = measure(
+            lambda: inference.predict_serving(batch, features={}), repeat, items=batch_size
+        )
+
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    import tensorflow as tf
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for stage, stats in current.items():
+        before = baseline.get(stage)
+        if not before:
+            continue
+        change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"]
+        marker = "REGRESSION" if change > tolerance else ""
+        print(f"{stage:32s} {before['p50_ms']:10.2f} -> {stats['p50_ms']:10.2f} ms  {change:+7.1%}  {marker}")
+        if change > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Write results JSON here (e.g. benchmarks/baseline.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown before flagging (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    for stage, stats in results.items():
+        print(f"{stage:32s} p50={stats['p50_ms']:9.2f}  p95={stats['p95_ms']:9.2f}  p99={stats['p99_ms']:9.2f} ms  "
+              f"{stats['throughput_per_s']:9.1f}/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
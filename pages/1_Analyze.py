@@ -1,25 +1,39 @@
 import streamlit as st
 st.set_page_config(page_title="Drawee | Analyze", page_icon="🖼️")
 
-import uuid
-import io
-import numpy as np
 import os
-import gdown
-import plotly.graph_objects as go
-import time
-from PIL import Image
-import cv2
-from tensorflow.keras.models import load_model
-from utils.auth import login, signup, is_authenticated, logout, get_supabase_client, get_supabase_admin_client
+from utils.auth import login, signup, is_authenticated, logout, get_supabase_client, get_supabase_admin_client, supabase_latency_stats
+from utils.models import models_error, models_ready, registry_stats, warm_up_in_background
+from utils.backends import BACKEND
+from utils.tracing import DEBUG_PANEL, Trace
+from utils.storage import decode_image, encode_drawing
+from utils.persistence import get_write_behind_queue
+from utils.deletion import delete_child
+from utils.data import ensure_children, fetch_children_summary, get_child_ids, get_children, get_display_name, invalidate_user_cache
 from classes_def import stage_insights, development_tips, recommended_activities, classes
-import Child_Records
+# The inference stack (utils.analysis), plotly and Child_Records are imported where they are
+# used, so reruns that don't analyze or show records never pay for them on a cold worker.
 
 supabase_admin = get_supabase_admin_client()
 if supabase_admin is None:
     st.error("Error: Unable to connect to Supabase.")
     st.stop()
 
+# Models are loaded once per process and shared by every session
+warm_up_in_background()
+
+
+def show_models_unavailable():
+    error = models_error()
+    if error:
+        st.error(f"❌ Drawing analysis is unavailable: the models could not be loaded ({error}). The server keeps retrying.")
+    else:
+        st.info("⏳ The analysis models are still being prepared on the server. Please try again in a minute.")
+
+
+# Background writer for storage uploads and result inserts (resumes spooled jobs on restart)
+write_behind = get_write_behind_queue(supabase_admin)
+
 # --- Get query params to detect if showing Child Records or Analyze ---
 # child_id = st.query_params.get("child_id", [None])[0]
 child_id = st.session_state.get("selected_child_id", None)
@@ -106,32 +120,6 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def get_model(model_name):
-    model_map = {
-        "resnet": {
-            "file_id": "1zx4ks1V2SPZem8oeqpNc2cYqN6l_z0oJ",
-            "filename": "drawee-resnet.h5"
-        },
-        "xception": {
-            "file_id": "1ibBelZfUwtr_GEP26mjStfJZYj3HeFtg",
-            "filename": "drawee-xception.h5"
-        }
-    }
-
-    model_info = model_map.get(model_name)
-    if not model_info:
-        raise ValueError(f"Unknown model name: {model_name}")
-
-    output_path = f"model_cache/{model_info['filename']}"
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-    if not os.path.exists(output_path):
-        url = f"https://drive.google.com/uc?id={model_info['file_id']}"
-        gdown.download(url, output_path, quiet=False)
-
-    return load_model(output_path)
-
-
 if is_authenticated():
 
     if child_id is None:
@@ -139,9 +127,7 @@ if is_authenticated():
         
         with st.container():
             user_id = st.session_state['user']['id']
-            profile_resp = supabase_admin.table("profiles").select("display_name").eq("id", user_id).single().execute()
-
-            display_name = profile_resp.data["display_name"] if profile_resp.data and "display_name" in profile_resp.data else st.session_state['user']['email']
+            display_name = get_display_name(supabase_admin, user_id, st.session_state['user']['email'])
 
             st.markdown(f"""
                 <div style="
@@ -163,32 +149,135 @@ if is_authenticated():
 
         # --- Existing Analyze UI here ---
 
-        # Fetch existing children names for autocomplete
         user_id = st.session_state['user']['id']
-        children_response = supabase_admin.table("children").select("name").eq("user_id", user_id).execute()
-        existing_children = [c['name'] for c in children_response.data] if children_response.data else []
 
-        options = ["New Record"] + existing_children
-        selected_name = st.selectbox("Select a child or create a new record:", options)
+        # Results are saved in the background; show anything still in flight for this user
+        persist_status = write_behind.status(user_id)
+        if persist_status["pending"]:
+            st.info(f"⏳ Saving {persist_status['pending']} drawing(s) in the background...")
+        if persist_status["failed"]:
+            st.warning(f"⚠️ {persist_status['failed']} drawing(s) could not be saved: {persist_status['errors'][0]}")
+            if st.button("Retry Saving"):
+                write_behind.retry_failed(user_id)
+                st.rerun()
+
+        batch_mode = st.toggle("Batch mode: analyze a whole class's drawings at once")
+
+        if batch_mode:
+            # --- Batch Analyze UI ---
+            child_name = ""
+            st.markdown("<h5>📚 Upload the Class's Drawings</h5>", unsafe_allow_html=True)
+            uploads = st.file_uploader("", type=["png", "jpg", "jpeg"], accept_multiple_files=True, key="batch_file_input", label_visibility="collapsed")
+
+            # Which child each drawing is saved under; nothing is created until the mapping is confirmed
+            mapping_ok = False
+            if uploads:
+                existing_names = [c["name"] for c in get_children(supabase_admin, user_id)]
+                assign_by = st.radio(
+                    "Save the drawings under:", ["One child", "The child named in each file name"], horizontal=True
+                )
+                if assign_by == "One child":
+                    target = st.selectbox("Child", existing_names) if existing_names else ""
+                    if not existing_names:
+                        st.info("No children yet: type a name for each drawing below.")
+                    proposed = [target] * len(uploads)
+                else:
+                    st.caption("For example `Maria Santos.jpg` is saved under Maria Santos.")
+                    proposed = [os.path.splitext(u.name)[0].strip() for u in uploads]
+                mapping = st.data_editor(
+                    [{"File": u.name, "Child": name} for u, name in zip(uploads, proposed)],
+                    disabled=["File"], use_container_width=True,
+                    key=f"batch_mapping_{hash((assign_by, tuple(proposed), tuple(u.name for u in uploads)))}"
+                )
+                batch_names = [(row["Child"] or "").strip() for row in mapping]
+                new_children = sorted(set(batch_names) - set(existing_names) - {""})
+                if "" in batch_names:
+                    st.error("Every drawing needs a child.")
+                else:
+                    if new_children:
+                        st.warning(f"{len(new_children)} new child record(s) will be created: {', '.join(new_children)}")
+                    mapping_ok = st.checkbox("The drawing → child mapping above is correct")
 
-        new_child_name = None
-        if selected_name == "New Record":
-            new_child_name = st.text_input("Enter new child's name")
+            if uploads and st.button("Analyze All Drawings", use_container_width=True, disabled=not mapping_ok):
+                if not models_ready():
+                    show_models_unavailable()
+                    st.stop()
+                with st.spinner(f"Analyzing {len(uploads)} drawings..."):
+                    from utils.analysis import analyze_batch, preprocess_images
+                    from utils.explain import get_explainer, image_hash
+                    from utils.similarity import encode_embedding
+
+                    try:
+                        batch_images = [decode_image(u) for u in uploads]
+                    except Exception as e:
+                        st.error(f"❌ Could not read one of the drawings: {e}")
+                        st.stop()
+                    batch = preprocess_images(batch_images)
+
+                    try:
+                        # Re-uploaded or re-photographed drawings reuse their cached probabilities
+                        batch_features = {}
+                        batch_preds, batch_hits = analyze_batch(batch, features=batch_features, user_id=user_id)
+                    except Exception as e:
+                        st.error(f"❌ {e}")
+                        st.stop()
+
+                    batch_child_ids = ensure_children(supabase_admin, user_id, batch_names)
+
+                    batch_rows = []
+                    batch_embeddings = batch_features.get("embedding") or [None] * len(batch_preds)
+                    explainer = get_explainer(supabase_admin)
+                    for name, im, image, pred, embedding in zip(batch_names, batch_images, batch, batch_preds, batch_embeddings):
+                        pred_class = int(pred.argmax())
+                        image_files = encode_drawing(im)
+                        drawing_hash = image_hash(image_files["image_path"])
+                        row = {
+                            "user_id": user_id,
+                            "child_id": batch_child_ids.get(name),
+                            "child_name": name,
+                            "prediction": classes[pred_class],
+                            "confidence": float(pred[pred_class] * 100),
+                            "embedding": encode_embedding(embedding),
+                            "image_hash": drawing_hash
+                        }
+                        # Uploaded and inserted in bulk by the write-behind worker
+                        write_behind.enqueue(row, image_files)
+                        # Grad-CAM heatmaps are computed afterwards, off the request path
+                        explainer.submit(user_id, drawing_hash, image, pred_class, im)
+                        batch_rows.append(row)
+
+                st.success(f"Analyzed {len(batch_rows)} drawing(s); they are being saved in the background.")
+                if batch_hits.any():
+                    st.caption(f"{int(batch_hits.sum())} drawing(s) were analyzed before, so their earlier results were reused.")
+                st.dataframe(
+                    [{"Child": r["child_name"], "Stage": r["prediction"], "Confidence": f"{r['confidence']:.2f}%"} for r in batch_rows],
+                    use_container_width=True
+                )
+
+            st.markdown("---")
+        else:
+            # Existing children names for autocomplete (cached per user)
+            existing_children = [c['name'] for c in get_children(supabase_admin, user_id)]
 
-        child_name = new_child_name.strip() if new_child_name else (selected_name if selected_name != "New Record" else "")
+            options = ["New Record"] + existing_children
+            selected_name = st.selectbox("Select a child or create a new record:", options)
+
+            new_child_name = None
+            if selected_name == "New Record":
+                new_child_name = st.text_input("Enter new child's name")
+
+            child_name = new_child_name.strip() if new_child_name else (selected_name if selected_name != "New Record" else "")
 
         if child_name:
-            child_response = supabase_admin.table("children").select("id").eq("name", child_name).eq("user_id", user_id).execute()
+            child_id_local = get_child_ids(supabase_admin, user_id).get(child_name)
 
-            if child_response.data and len(child_response.data) > 0:
-                # Use the first existing child record
-                child_id_local = child_response.data[0]['id']
-            else:
+            if child_id_local is None:
                 # No child found – insert a new child record
                 insert_response = supabase_admin.table("children").insert({
                     "name": child_name,
                     "user_id": user_id
                 }).execute()
+                invalidate_user_cache(user_id, "children", "children_summary")
 
                 if insert_response.data and len(insert_response.data) > 0:
                     child_id_local = insert_response.data[0]['id']
@@ -204,72 +293,81 @@ if is_authenticated():
 
 
             if upload:
-                im = Image.open(upload).convert("RGB")
-                img = np.asarray(im)
+                trace = Trace("analyze", user_id=user_id, backend=BACKEND)
 
-                # --- Preprocessing for ResNet ---
-                resnet_img = cv2.resize(img, (256, 256)) / 255.0
-                resnet_input = np.expand_dims(resnet_img, axis=0)
+                with trace.span("import"):
+                    from utils.analysis import analyze, preprocess_images, runtime_stats
+                    from utils.explain import get_explainer, image_hash
+                    from utils.similarity import encode_embedding
 
-                # --- Preprocessing for Xception ---
-                xception_img = cv2.resize(img, (256, 256)) / 255.0
-                xception_input = np.expand_dims(xception_img, axis=0)
+                with trace.span("decode"):
+                    try:
+                        im = decode_image(upload)
+                    except Exception as e:
+                        st.error(f"❌ Could not read this drawing: {e}")
+                        st.stop()
+
+                # --- Shared preprocessing: resize once, normalized per backbone at predict time ---
+                with trace.span("resize"):
+                    batch = preprocess_images([im])
 
                 @st.dialog("🎯 Analysis Result")
                 def show_result_dialog():
-                    with st.spinner("Analyzing your drawing..."):
-                        time.sleep(2)
-
-                        # Load both models
-                        resnet_model = get_model("resnet")
-                        xception_model = get_model("xception")
-
-                        try:
-                            resnet_pred = resnet_model.predict(resnet_input)
-                        except Exception as e:
-                            st.error(f"❌ ResNet model prediction failed: {e}")
-                            return
-
-                        try:
-                            xception_pred = xception_model.predict(xception_input)
-                        except Exception as e:
-                            st.error(f"❌ Xception model prediction failed: {e}")
-                            return
-
-                        # Ensure shapes match for averaging
-                        if resnet_pred.shape != xception_pred.shape:
-                            st.error(f"⚠️ Prediction shape mismatch: ResNet shape {resnet_pred.shape}, Xception shape {xception_pred.shape}")
-                            return
-
-                        # Average predictions
-                        final_pred = (resnet_pred + xception_pred) / 2
-                        pred_class = np.argmax(final_pred)
-                        stage_name = classes[pred_class]
-                        confidence = final_pred[0][pred_class] * 100
-
-                        # Save image to storage
-                        image_bytes = io.BytesIO()
-                        im.save(image_bytes, format='PNG')
-                        image_bytes = image_bytes.getvalue()
-                        filename = f"{uuid.uuid4().hex}.png"
-                        storage_path = f"user_uploads/{filename}"
-
-                        supabase_admin.storage.from_("drawings").upload(storage_path, image_bytes)
-                        image_url = supabase_admin.storage.from_("drawings").get_public_url(storage_path)
-
-                        # Store result in Supabase
-                        supabase_admin.table("results").insert({
+                    progress = st.progress(0, text="Analyzing your drawing...")
+                    stage_progress = {
+                        "cache_lookup": (20, "Checking for an earlier analysis..."),
+                        "queued": (30, "Waiting for the models..."),
+                        "predicting": (45, "Running the models..."),
+                        "predicted": (70, "Reading the result..."),
+                    }
+
+                    try:
+                        # Cache misses are queued with concurrent sessions' requests and predicted as one micro-batch
+                        features = {}
+                        final_pred, cache_hits = analyze(
+                            batch, trace=trace, features=features, user_id=user_id,
+                            progress=lambda stage: progress.progress(*stage_progress[stage])
+                        )
+                    except Exception as e:
+                        progress.empty()
+                        st.error(f"❌ {e}")
+                        trace.fields["error"] = str(e)
+                        trace.emit()
+                        return
+
+                    pred_class = int(final_pred[0].argmax())
+                    stage_name = classes[pred_class]
+                    confidence = final_pred[0][pred_class] * 100
+
+                    # Spool image and result; the upload and insert happen in the background
+                    progress.progress(75, text="Preparing your drawing...")
+                    with trace.span("encode"):
+                        image_files = encode_drawing(im)
+                    progress.progress(90, text="Saving your drawing...")
+                    drawing_hash = image_hash(image_files["image_path"])
+                    with trace.span("enqueue"):
+                        write_behind.enqueue({
                             "user_id": user_id,
                             "child_id": child_id_local,
                             "child_name": child_name,
-                            "image_path": image_url,
                             "prediction": stage_name,
-                            "confidence": float(confidence)
-                        }).execute()
+                            "confidence": float(confidence),
+                            # None if the backend has no embeddings; scripts/backfill_embeddings.py fills those in
+                            "embedding": encode_embedding(features.get("embedding", [None])[0]),
+                            "image_hash": drawing_hash
+                        }, image_files)
+                        # Grad-CAM heatmap for the records page, computed in the background
+                        get_explainer(supabase_admin).submit(user_id, drawing_hash, batch[0], pred_class, im)
+                    progress.progress(100, text="Done")
+
+                    progress.empty()
+                    trace_record = trace.emit()
 
                     # Display results
                     st.markdown(f"**{stage_name}** - {stage_insights[stage_name]}")
                     st.success(f"{stage_name}: **{confidence:.2f}%**")
+                    if cache_hits[0]:
+                        st.caption("This drawing was analyzed before, so its earlier result was reused.")
                     st.image(im, caption='Uploaded Drawing', use_container_width=True)
                     # st.write("ResNet prediction:", resnet_pred)
                     # st.write("Xception prediction:", xception_pred)
@@ -277,6 +375,7 @@ if is_authenticated():
                     # st.image(im, caption='Uploaded Drawing', use_container_width=True)
 
                     # Plot bar chart
+                    import plotly.graph_objects as go
                     fig = go.Figure(go.Bar(
                         x=final_pred[0] * 100,
                         y=classes,
@@ -295,8 +394,22 @@ if is_authenticated():
                     for activity in recommended_activities[stage_name]:
                         st.markdown(f"- {activity}")
 
+                    if DEBUG_PANEL or st.query_params.get("debug") == "1":
+                        with st.expander("⏱️ Request Timing"):
+                            st.caption(f"Request {trace_record['request_id']} · total {trace_record['total_ms']:.0f} ms")
+                            st.dataframe(trace_record["spans"], use_container_width=True)
+                            st.json({
+                                **runtime_stats(),
+                                "models": registry_stats(),
+                                "supabase": supabase_latency_stats(),
+                            })
+
 
-                show_result_dialog()
+                # The weights are fetched in the background at startup; never make a user wait on that download
+                if models_ready():
+                    show_result_dialog()
+                else:
+                    show_models_unavailable()
 
             st.markdown("---")
 
@@ -351,22 +464,23 @@ if is_authenticated():
         st.markdown("<h5>List of Children's Drawings Analyzed</h5>", unsafe_allow_html=True)
 
         try:
-            # Fetch children from Supabase
-            child_list = supabase_admin.table("children").select("id, name").eq("user_id", user_id).execute()
+            # Fetch children with their record counts and latest stage in one query
+            child_list = fetch_children_summary(supabase_admin, user_id)
 
             # Handle delete via query param
             delete_child_id = st.query_params.get("delete_child_id")
             if delete_child_id:
                 try:
-                    supabase_admin.table("results").delete().eq("child_id", delete_child_id).execute()
-                    supabase_admin.table("children").delete().eq("id", delete_child_id).execute()
+                    # Pending writes are dropped, rows removed in one transaction, then their drawings from storage
+                    delete_child(supabase_admin, user_id, delete_child_id, write_behind)
+                    invalidate_user_cache(user_id, "children", "children_summary", "embeddings")
                     st.success("Child and associated records deleted successfully.")
                     st.query_params.clear()  # Clear query params
                     st.rerun()
                 except Exception as e:
                     st.error(f"Failed to delete child: {e}")
 
-            if not child_list.data:
+            if not child_list:
                 st.info("No child records found yet.")
             else:
                 # Header row
@@ -381,11 +495,14 @@ if is_authenticated():
                 # Handle view via query param
                 if "child_id" in st.query_params:
                     st.session_state["selected_child_id"] = st.query_params["child_id"]
+                    # Start the records list from the first page again
+                    st.session_state.pop(f"records_pages_{st.query_params['child_id']}", None)
                     st.query_params.clear()
                     st.rerun()
 
-                for idx, child in enumerate(child_list.data):
-                    result_count = supabase_admin.table("results").select("id", count="exact").eq("child_id", child['id']).execute().count or 0
+                for idx, child in enumerate(child_list):
+                    result_count = child['record_count']
+                    latest_stage = child['latest_stage'] or "No analysis yet"
                     view_url = f"?child_id={child['id']}"
                     delete_form = f"""
                         <form method="get" style="margin: 0;" onsubmit="return confirm('Are you sure you want to delete this child and all associated records?');">
@@ -417,7 +534,7 @@ if is_authenticated():
                             font-size: 13px;
                         ">
                             <div style="flex: 3; font-weight: bold;">{child['name']}</div>
-                            <div style="flex: 2; color: #888;">{result_count} record(s)</div>
+                            <div style="flex: 2; color: #888;">{result_count} record(s)<br><small>{latest_stage}</small></div>
                             <div style="flex: 2; display: flex; gap: 0.5rem;">
                                 <a href="{view_url}" style="
                                     flex: 1;
@@ -439,6 +556,7 @@ if is_authenticated():
 
     else:
         # --- Show Child Records UI ---
+        import Child_Records
         Child_Records.render_child_records(child_id)
 else:
     # --- Title ---
@@ -0,0 +1,71 @@
+"""
+Compute embeddings for results rows that don't have one yet.
+
+    python -m scripts.backfill_embeddings [--batch-size 32] [--limit 1000]
+
+Rows analyzed before embeddings were stored, or by a backend that doesn't provide them, have
+a NULL embedding and are missing from "similar drawings" searches. This downloads their
+stored drawings, runs them through the models and writes the embedding back. Predictions
+are left as they were.
+"""
+import argparse
+import io
+
+import httpx
+import numpy as np
+
+from utils.auth import get_supabase_admin_client
+from utils.preprocess import stack_batch
+from utils.similarity import encode_embedding
+from utils.storage import decode_image
+
+
+def missing_rows(client, limit: int) -> list:
+    return (
+        client.table("results").select("id, image_path")
+        .is_("embedding", "null").not_.is_("image_path", "null")
+        .limit(limit).execute().data or []
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=1000, help="Rows to process in this run")
+    args = parser.parse_args()
+
+    from utils.inference import predict_in_batches
+
+    client = get_supabase_admin_client()
+    rows = missing_rows(client, args.limit)
+    print(f"{len(rows)} row(s) without an embedding")
+
+    done = 0
+    with httpx.Client(timeout=30) as http:
+        for start in range(0, len(rows), args.batch_size):
+            chunk, images = [], []
+            for row in rows[start:start + args.batch_size]:
+                try:
+                    response = http.get(row["image_path"])
+                    response.raise_for_status()
+                    images.append(np.asarray(decode_image(io.BytesIO(response.content))))
+                    chunk.append(row)
+                except Exception as e:
+                    print(f"Skipping {row['id']}: {e}")
+            if not chunk:
+                continue
+
+            features = {}
+            predict_in_batches(stack_batch(images), args.batch_size, features=features)
+            if "embedding" not in features:
+                raise SystemExit("The configured backend does not provide embeddings (use DRAWEE_BACKEND=keras)")
+            for row, embedding in zip(chunk, features["embedding"]):
+                client.table("results").update({"embedding": encode_embedding(embedding)}).eq("id", row["id"]).execute()
+            done += len(chunk)
+            print(f"{done}/{len(rows)} embedded")
+
+    # Running servers pick the new embeddings up when their cached index expires (DRAWEE_READ_CACHE_TTL)
+
+
+if __name__ == "__main__":
+    main()
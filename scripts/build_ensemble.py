@@ -0,0 +1,49 @@
+"""
+Build the fused ResNet + Xception ensemble used for serving.
+
+    python -m scripts.build_ensemble [--output model_cache/drawee-ensemble.keras]
+
+The fused graph takes one input, runs both backbones in parallel and averages them
+in-graph. The app picks it up automatically once the file exists.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from utils.artifacts import write_sidecar
+from utils.ensemble import build_from_registry
+from utils.models import BACKBONES, INPUT_SHAPE, model_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=model_path("ensemble"))
+    parser.add_argument("--savedmodel", help="Also export a TensorFlow SavedModel to this directory")
+    args = parser.parse_args()
+
+    fused = build_from_registry()
+
+    # Sanity check: in-graph average must match averaging the per-model outputs
+    sample = np.random.default_rng(0).random((4,) + INPUT_SHAPE, dtype=np.float32)
+    outputs = fused.predict(sample, verbose=0)
+    expected = np.mean([outputs[name] for name in BACKBONES], axis=0)
+    max_diff = float(np.max(np.abs(outputs["ensemble"] - expected)))
+    if max_diff > 1e-5:
+        raise SystemExit(f"Fused ensemble disagrees with per-model average (max diff {max_diff:.2e})")
+
+    # Save under a temporary name and rename, so a crash never leaves a partial model behind;
+    # the sidecar digest is what lets utils.artifacts trust the file afterwards
+    tmp_path = args.output + ".tmp.keras"
+    fused.save(tmp_path)
+    os.replace(tmp_path, args.output)
+    digest = write_sidecar(args.output)
+    print(f"Saved fused ensemble to {args.output} (sha256 {digest})")
+
+    if args.savedmodel:
+        fused.export(args.savedmodel)
+        print(f"Exported SavedModel to {args.savedmodel}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Classify an archive of drawings offline, outside the Streamlit UI.
+
+    python -m scripts.classify --input scans/ --output predictions.csv
+    python -m scripts.classify --manifest files.txt --output predictions.parquet --workers 8
+
+Images are decoded and resized in a process pool and then predicted in batches with
+the same models as the app. Each row holds the path, the predicted stage, its confidence
+and one `prob_<stage>` column per stage. Output is appended batch by batch: CSV goes to one
+file and Parquet to part files in a directory. Paths listed in <output>.checkpoint or
+already present in the output are skipped, so an interrupted run resumes where it stopped
+without duplicating rows.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from classes_def import classes
+from utils.storage import decode_image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def iter_paths(input_dir: str = None, manifest: str = None):
+    if manifest:
+        with open(manifest, newline="") as f:
+            if manifest.endswith(".csv"):
+                for row in csv.DictReader(f):
+                    yield row["path"]
+            else:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+    else:
+        for root, _, files in os.walk(input_dir):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def load_image(path: str):
+    """
+    Pool worker: decode and resize one drawing. Returns (path, uint8 image or None, error).
+    """
+    from utils.preprocess import stack_batch
+    try:
+        return path, stack_batch([np.asarray(decode_image(path))])[0], None
+    except Exception as e:
+        return path, None, str(e)
+
+
+class ResultWriter:
+    def __init__(self, output: str):
+        self.output = output
+        self.parquet = output.endswith(".parquet")
+        self.checkpoint = output + ".checkpoint"
+        self.errors = output + ".errors"
+        self.parts = 0
+        if self.parquet:
+            os.makedirs(output, exist_ok=True)
+            self.parts = len([n for n in os.listdir(output) if n.endswith(".parquet")])
+
+    def done_paths(self) -> set:
+        """
+        Paths in the checkpoint, plus any whose rows reached the output before a crash kept
+        them out of the checkpoint.
+        """
+        done = set()
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as f:
+                done = {line.rstrip("\n") for line in f}
+        written = self._written_paths() - done
+        if written:
+            with open(self.checkpoint, "a") as f:
+                f.writelines(f"{path}\n" for path in sorted(written))
+        return done | written
+
+    def _written_paths(self) -> set:
+        if self.parquet:
+            import pandas as pd
+            return {
+                path
+                for name in os.listdir(self.output) if name.endswith(".parquet")
+                for path in pd.read_parquet(os.path.join(self.output, name), columns=["path"])["path"]
+            }
+        if not os.path.exists(self.output):
+            return set()
+        self._drop_partial_line()
+        with open(self.output, newline="") as f:
+            return {row["path"] for row in csv.DictReader(f)}
+
+    def _drop_partial_line(self):
+        # A crash mid-append can leave half a CSV row; cut the file back to its last full line
+        with open(self.output, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def write(self, paths: list, preds: np.ndarray):
+        rows = []
+        for path, pred in zip(paths, preds):
+            pred_class = int(np.argmax(pred))
+            row = {"path": path, "prediction": classes[pred_class], "confidence": float(pred[pred_class] * 100)}
+            row.update({f"prob_{label}": float(p) for label, p in zip(classes, pred)})
+            rows.append(row)
+
+        if self.parquet:
+            import pandas as pd
+            part = os.path.join(self.output, f"part-{self.parts:05d}.parquet")
+            # Written under a temporary name first, so a crash never leaves a truncated part
+            pd.DataFrame(rows).to_parquet(part + ".tmp", index=False)
+            os.replace(part + ".tmp", part)
+            self.parts += 1
+        else:
+            new_file = not os.path.exists(self.output)
+            with open(self.output, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+
+        # Only mark paths done once their rows are on disk
+        with open(self.checkpoint, "a") as f:
+            f.writelines(f"{path}\n" for path in paths)
+
+    def write_error(self, path: str, error: str):
+        with open(self.errors, "a") as f:
+            f.write(f"{path}\t{error}\n")
+        with open(self.checkpoint, "a") as f:
+            f.write(f"{path}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory of drawings (searched recursively)")
+    source.add_argument("--manifest", help="Text file with one path per line, or a CSV with a `path` column")
+    parser.add_argument("--output", required=True, help="predictions.csv or predictions.parquet")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--report-every", type=int, default=10, help="Report throughput every N batches")
+    args = parser.parse_args()
+
+    writer = ResultWriter(args.output)
+    done = writer.done_paths()
+    paths = [p for p in iter_paths(args.input, args.manifest) if p not in done]
+    print(f"{len(paths)} drawing(s) to classify ({len(done)} already done)")
+    if not paths:
+        return
+
+    # Start the pool before TensorFlow is imported, so workers don't inherit its threads
+    with multiprocessing.Pool(args.workers) as pool:
+        from utils.inference import predict_in_batches
+
+        start = time.perf_counter()
+        processed, batches = 0, 0
+        batch_paths, batch_images = [], []
+
+        def flush():
+            nonlocal processed, batches
+            writer.write(batch_paths, predict_in_batches(np.stack(batch_images), args.batch_size))
+            processed += len(batch_paths)
+            batches += 1
+            batch_paths.clear()
+            batch_images.clear()
+            if batches % args.report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{processed}/{len(paths)} drawings, {processed / elapsed:.1f} images/s")
+
+        for path, image, error in pool.imap(load_image, paths, chunksize=8):
+            if image is None:
+                writer.write_error(path, error)
+                continue
+            batch_paths.append(path)
+            batch_images.append(image)
+            if len(batch_paths) == args.batch_size:
+                flush()
+        if batch_paths:
+            flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"Classified {processed} drawing(s) in {elapsed:.1f}s ({processed / elapsed:.1f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
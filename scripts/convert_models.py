@@ -0,0 +1,149 @@
+"""
+Convert the reference .h5 backbones for the CPU inference backends and check parity.
+
+    python -m scripts.convert_models --samples path/to/drawings [--backends tflite-fp16 tflite-int8 onnx]
+
+Each artifact is written next to its .h5 file together with a <artifact>.parity.json
+report. The samples are split once: int8 calibration only sees the calibration part, and
+parity compares the backend's class probabilities against the .h5 model on the held-out
+part only, so the numbers that gate a backend are not measured on its calibration data. The report records the SHA-256 of both files. utils.backends refuses any artifact
+whose report did not pass, or was made from other weights than the current .h5.
+
+The onnx backend needs `pip install tf2onnx onnxruntime`.
+"""
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from utils.artifacts import sha256_file
+from utils.backends import ARTIFACT_SUFFIXES, artifact_path, open_artifact, parity_report_path
+from utils.models import BACKBONES, INPUT_SHAPE, download_model
+from utils.preprocess import NORMALIZERS, stack_batch
+
+
+def load_samples(sample_dir: str, limit: int) -> np.ndarray:
+    """
+    uint8 sample batch from a directory of drawings (random pixels if none is given).
+    """
+    paths = []
+    if sample_dir:
+        for ext in ("png", "jpg", "jpeg"):
+            paths += glob.glob(os.path.join(sample_dir, f"**/*.{ext}"), recursive=True)
+    paths = sorted(paths)[:limit]
+    if not paths:
+        print("No sample drawings given; using random images (parity numbers will be less meaningful)")
+        return np.random.default_rng(0).integers(0, 256, (limit,) + INPUT_SHAPE, dtype=np.uint8)
+    return stack_batch([np.asarray(Image.open(p).convert("RGB")) for p in paths])
+
+
+def split_samples(samples: np.ndarray, holdout: float) -> tuple:
+    """
+    (calibration, held-out) after a fixed shuffle; both keep at least one image.
+    """
+    if len(samples) < 2:
+        raise SystemExit("Need at least two sample drawings to calibrate and check parity on separate images")
+    order = np.random.default_rng(0).permutation(len(samples))
+    n_holdout = min(len(samples) - 1, max(1, int(round(len(samples) * holdout))))
+    return samples[order[n_holdout:]], samples[order[:n_holdout]]
+
+
+def convert_tflite(model, samples: np.ndarray, quantization: str) -> bytes:
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Full int8 weights and activations; the input/output stay float32 for callers
+        def representative_dataset():
+            for image in samples:
+                yield [image[np.newaxis]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def convert_onnx(model, output_path: str):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="drawing"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=output_path)
+
+
+def check_parity(reference: np.ndarray, candidate: np.ndarray, min_agreement: float, max_abs_diff: float) -> dict:
+    agreement = float(np.mean(np.argmax(reference, axis=1) == np.argmax(candidate, axis=1)))
+    diff = float(np.max(np.abs(reference - candidate)))
+    return {
+        "samples": len(reference),
+        "top1_agreement": agreement,
+        "max_abs_diff": diff,
+        "mean_abs_diff": float(np.mean(np.abs(reference - candidate))),
+        "min_agreement": min_agreement,
+        "max_abs_diff_allowed": max_abs_diff,
+        "passed": agreement >= min_agreement and diff <= max_abs_diff,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", help="Directory of sample drawings for calibration and parity")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of sample drawings")
+    parser.add_argument("--holdout", type=float, default=0.5, help="Share of the samples kept out of calibration for parity")
+    parser.add_argument("--backends", nargs="+", default=list(ARTIFACT_SUFFIXES), choices=list(ARTIFACT_SUFFIXES))
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Required top-1 agreement with the .h5 model")
+    parser.add_argument("--max-abs-diff", type=float, default=0.05, help="Largest allowed probability difference")
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+
+    calibration, held_out = split_samples(load_samples(args.samples, args.limit), args.holdout)
+    print(f"{len(calibration)} calibration and {len(held_out)} held-out drawing(s)")
+    failed = False
+
+    for name in BACKBONES:
+        h5_path = download_model(name)
+        model = load_model(h5_path)
+        calibration_inputs = NORMALIZERS[name](calibration)
+        inputs = NORMALIZERS[name](held_out)
+        reference = model.predict(inputs, verbose=0)
+
+        for backend in args.backends:
+            path = artifact_path(h5_path, backend)
+            if backend == "onnx":
+                convert_onnx(model, path)
+            else:
+                with open(path, "wb") as f:
+                    f.write(convert_tflite(model, calibration_inputs, backend.split("-")[1]))
+
+            candidate = open_artifact(path, backend).predict(inputs)
+
+            report = check_parity(reference, candidate, args.min_agreement, args.max_abs_diff)
+            report.update({
+                "model": name,
+                "backend": backend,
+                "calibration_samples": len(calibration),
+                "size_mb": os.path.getsize(path) / (1024 * 1024),
+                # utils.backends refuses the artifact once either file no longer matches
+                "source_sha256": sha256_file(h5_path),
+                "artifact_sha256": sha256_file(path),
+            })
+            with open(parity_report_path(path), "w") as f:
+                json.dump(report, f, indent=2)
+
+            status = "OK " if report["passed"] else "FAIL"
+            print(f"[{status}] {name:9s} {backend:12s} agreement={report['top1_agreement']:.3f} "
+                  f"max_diff={report['max_abs_diff']:.4f} size={report['size_mb']:.1f} MB")
+            failed = failed or not report["passed"]
+
+    if failed:
+        raise SystemExit("Some backends failed parity and will not be used; see the .parity.json reports")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Fetch and verify the model weights ahead of time, e.g. in a deploy step or to fill a mirror.
+
+    python -m scripts.fetch_models                 # fetch into DRAWEE_MODEL_CACHE
+    python -m scripts.fetch_models --pin           # also record their SHA-256 in the lock file
+
+With DRAWEE_MODEL_MIRROR set, files are copied from that directory instead of downloaded.
+With DRAWEE_OFFLINE=1, the network is never used. Pin only files you have checked by hand:
+from then on, any artifact whose digest differs from the lock file is rejected.
+"""
+import argparse
+import json
+
+from utils.artifacts import LOCK_FILE, ensure_artifact, load_lock, sha256_file
+from utils.models import MODEL_MAP
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*", default=[n for n, info in MODEL_MAP.items() if info["file_id"]])
+    parser.add_argument("--pin", action="store_true", help=f"Write the fetched files' digests to {LOCK_FILE}")
+    args = parser.parse_args()
+
+    lock = load_lock()
+    failed = 0
+    for name in args.models:
+        info = MODEL_MAP[name]
+        try:
+            path = ensure_artifact(info["filename"], info["file_id"])
+        except Exception as e:
+            print(f"{name}: FAILED ({e})")
+            failed += 1
+            continue
+        digest = sha256_file(path)
+        print(f"{name}: {path} sha256={digest}")
+        lock[info["filename"]] = digest
+
+    if args.pin:
+        with open(LOCK_FILE, "w") as f:
+            json.dump(lock, f, indent=2, sort_keys=True)
+        print(f"Pinned {len(lock)} artifact(s) in {LOCK_FILE}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Report import times of the app's modules and guard cold page loads.
+
+    python -m scripts.import_report [--top 15] [--budget-ms 300]
+
+Each module is imported in a fresh interpreter with `python -X importtime`, and the
+heaviest dependencies it pulls in are listed. Streamlit pages run their whole script when
+imported, so for a page (a .py path) only its top-level import statements are timed. The
+page-level modules in EAGER_MODULES must not pull in any of HEAVY_PACKAGES and must stay
+within the time budget, and every module must import at all (utils.auth and the pages read
+Streamlit secrets at import time, so run this where .streamlit/secrets.toml exists). Otherwise
+the script exits non-zero, so a stray top-level `import tensorflow` is caught before release.
+"""
+import argparse
+import ast
+import re
+import subprocess
+import sys
+
+# Imported at the top of Home.py / pages/1_Analyze.py on every rerun, and the pages themselves
+EAGER_MODULES = [
+    "Home.py",
+    "pages/1_Analyze.py",
+    "classes_def",
+    "utils.auth",
+    "utils.models",
+    "utils.backends",
+    "utils.tracing",
+    "utils.storage",
+    "utils.persistence",
+    "utils.data",
+    "utils.deletion",
+]
+# Imported only when an analysis starts (or preloaded in the background)
+LAZY_MODULES = ["utils.analysis", "Child_Records"]
+HEAVY_PACKAGES = {"tensorflow", "keras", "cv2", "plotly", "pandas", "gdown"}
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_code(module: str) -> str:
+    """
+    The statements to time: `import module`, or a page's top-level imports.
+    """
+    if not module.endswith(".py"):
+        return f"import {module}"
+    with open(module) as f:
+        tree = ast.parse(f.read(), module)
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(module: str) -> tuple:
+    """
+    (total_ms, [(cumulative_us, package, depth)] for every module imported by `module`).
+    """
+    code = f"import time\n_start = time.perf_counter()\n{import_code(module)}\nprint((time.perf_counter() - _start) * 1000)"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            rows.append((int(match.group(2)), match.group(4), len(match.group(3)) // 2))
+    return float(proc.stdout.strip().splitlines()[-1]), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=10, help="Heaviest dependencies to list per module")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="Import budget for each eager module")
+    args = parser.parse_args()
+
+    problems = []
+    for module in EAGER_MODULES + LAZY_MODULES:
+        try:
+            total_ms, rows = import_times(module)
+        except RuntimeError as e:
+            # A module that can't be imported can't be checked; e.g. utils.auth and the pages
+            # need .streamlit/secrets.toml
+            print(f"\n{module}: {e}")
+            problems.append(f"{module} could not be imported")
+            continue
+
+        kind = "eager" if module in EAGER_MODULES else "lazy"
+        print(f"\n{module} ({kind}): {total_ms:.0f} ms")
+        for us, name, _ in sorted(rows, reverse=True)[:args.top]:
+            print(f"  {us / 1000:8.1f} ms  {name}")
+
+        if module in EAGER_MODULES:
+            heavy = sorted({name.split(".")[0] for _, name, _ in rows} & HEAVY_PACKAGES)
+            if heavy:
+                problems.append(f"{module} imports {', '.join(heavy)}")
+            if total_ms > args.budget_ms:
+                problems.append(f"{module} takes {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if problems:
+        print("\nStartup regressions:")
+        for problem in problems:
+            print(f"  - {problem}")
+        raise SystemExit(1)
+    print("\nAll modules import and the eager ones are within budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Find and purge drawings and heatmaps in storage that nothing references any more.
+
+    python -m scripts.reconcile_storage            # report only
+    python -m scripts.reconcile_storage --apply    # delete the orphans in batches
+
+Drawings are kept while a results row references them. Heatmap rows are kept while a
+result of the same user has their image hash; the rest are stale (e.g. their result was
+dropped before it was written) and removed with --apply. Heatmap objects are kept while a
+live heatmaps row references them. Objects and rows younger than --grace-hours are
+skipped, and so are drawings of a job still in the write-behind spool: in both cases the
+upload can land before its row.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+
+from utils.auth import get_supabase_admin_client
+from utils.deletion import remove_objects, storage_path_from_url
+from utils.explain import HEATMAP_PREFIX
+from utils.persistence import SPOOL_DIR
+from utils.storage import BUCKET, UPLOAD_PREFIX
+
+PAGE_SIZE = 1000
+
+
+def list_objects(client, prefix: str = UPLOAD_PREFIX) -> list:
+    bucket = client.storage.from_(BUCKET)
+    objects, offset = [], 0
+    while True:
+        page = bucket.list(prefix, {"limit": PAGE_SIZE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+        objects += page
+        if len(page) < PAGE_SIZE:
+            return objects
+        offset += PAGE_SIZE
+
+
+def list_heatmap_objects(client) -> list:
+    """
+    Objects under heatmaps/<user id>/, named by their path below heatmaps/.
+    """
+    objects = []
+    # Folders are listed without an id
+    for folder in (obj["name"] for obj in list_objects(client, HEATMAP_PREFIX) if obj.get("id") is None):
+        objects += [{**obj, "name": f"{folder}/{obj['name']}"} for obj in list_objects(client, f"{HEATMAP_PREFIX}/{folder}")]
+    return objects
+
+
+def select_all(client, table: str, columns: str, order: tuple) -> list:
+    """
+    Every row of `table`, paged in a stable order: without one, pages can overlap or skip
+    rows, and a skipped row's drawing would be purged as an orphan.
+    """
+    rows, start = [], 0
+    while True:
+        query = client.table(table).select(columns)
+        for column in order:
+            query = query.order(column)
+        page = query.range(start, start + PAGE_SIZE - 1).execute().data or []
+        rows += page
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def row_count(client, table: str) -> int:
+    return client.table(table).select("*", count="exact").limit(1).execute().count
+
+
+def referenced_paths(results: list) -> set:
+    return {storage_path_from_url(row.get(column)) for row in results for column in ("image_path", "thumbnail_path")}
+
+
+def older_than(timestamp: str, cutoff: datetime) -> bool:
+    return not timestamp or datetime.fromisoformat(timestamp.replace("Z", "+00:00")) <= cutoff
+
+
+def spooled_job_ids() -> set:
+    if not os.path.isdir(SPOOL_DIR):
+        return set()
+    return {name.split(".", 1)[0] for name in os.listdir(SPOOL_DIR) if name.endswith(".json")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="Delete the orphans (default: report only)")
+    parser.add_argument("--grace-hours", type=float, default=24.0)
+    args = parser.parse_args()
+
+    client = get_supabase_admin_client()
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=args.grace_hours)
+    counts = {table: row_count(client, table) for table in ("results", "heatmaps")}
+    results = select_all(client, "results", "id, user_id, image_path, thumbnail_path, image_hash", ("id",))
+    referenced = referenced_paths(results)
+    pending = spooled_job_ids()
+
+    orphans = []
+    for obj in list_objects(client):
+        path = f"{UPLOAD_PREFIX}/{obj['name']}"
+        if path in referenced or obj["name"].split(".", 1)[0].split("_", 1)[0] in pending:
+            continue
+        if older_than(obj.get("created_at"), cutoff):
+            orphans.append(path)
+
+    # --- Heatmaps ---
+    hashes = {(row["user_id"], row["image_hash"]) for row in results if row.get("image_hash")}
+    stale, heatmap_paths = [], set()
+    for row in select_all(client, "heatmaps", "user_id, image_hash, path, created_at", ("user_id", "image_hash")):
+        if (row["user_id"], row["image_hash"]) not in hashes and older_than(row["created_at"], cutoff):
+            stale.append(row)
+        else:
+            heatmap_paths.add(storage_path_from_url(row["path"]))
+    for obj in list_heatmap_objects(client):
+        path = f"{HEATMAP_PREFIX}/{obj['name']}"
+        if path not in heatmap_paths and older_than(obj.get("created_at"), cutoff):
+            orphans.append(path)
+
+    print(f"{len(orphans)} orphaned object(s) out of {len(referenced) + len(heatmap_paths)} referenced path(s); "
+          f"{len(stale)} stale heatmap row(s)")
+    if args.apply:
+        changed = [table for table, count in counts.items() if row_count(client, table) != count]
+        if changed:
+            raise SystemExit(f"{', '.join(changed)} changed during the scan; nothing deleted, run again")
+        for row in stale:
+            client.table("heatmaps").delete().eq("user_id", row["user_id"]).eq("image_hash", row["image_hash"]).execute()
+        if orphans:
+            removed = remove_objects(client, orphans)
+            print(f"Removed {removed} object(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Pick early-exit thresholds from a labelled sample of drawings.
+
+    python -m scripts.tune_early_exit --input labelled/ --target-agreement 0.99
+    python -m scripts.tune_early_exit --manifest sample.csv --target-agreement 0.995
+
+--input is a directory with one sub-directory per stage, named as in classes_def.classes.
+--manifest is a CSV with `path` and `label` columns. Every backbone is run over the whole
+sample. For each (min_prob, min_margin) pair on a grid, the script computes how often the
+early exit would fire, how often the early-exit result agrees with the full ensemble, and
+the accuracy against the labels. It then prints the pair with the highest exit rate whose
+agreement reaches the target, as the environment variables to set.
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from classes_def import classes
+from scripts.classify import iter_paths, load_image
+
+PROB_GRID = np.round(np.arange(0.50, 1.00, 0.01), 2)
+MARGIN_GRID = np.round(np.arange(0.00, 0.95, 0.05), 2)
+
+
+def labelled_paths(input_dir: str = None, manifest: str = None) -> list:
+    """
+    [(path, class index)] for every drawing whose label is a known stage.
+    """
+    if manifest:
+        with open(manifest, newline="") as f:
+            rows = [(row["path"], row["label"]) for row in csv.DictReader(f)]
+    else:
+        rows = [(path, os.path.basename(os.path.dirname(path))) for path in iter_paths(input_dir)]
+    return [(path, classes.index(label)) for path, label in rows if label in classes]
+
+
+def sweep(first: np.ndarray, full: np.ndarray, labels: np.ndarray) -> list:
+    from utils.inference import confident
+
+    full_class = full.argmax(axis=1)
+    rows = []
+    for min_prob in PROB_GRID:
+        for min_margin in MARGIN_GRID:
+            exits = confident(first, min_prob, min_margin)
+            final_class = np.where(exits, first.argmax(axis=1), full_class)
+            rows.append({
+                "min_prob": float(min_prob),
+                "min_margin": float(min_margin),
+                "exit_rate": float(exits.mean()),
+                "agreement": float((final_class == full_class).mean()),
+                "accuracy": float((final_class == labels).mean()),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Directory with one sub-directory per stage")
+    source.add_argument("--manifest", help="CSV with `path` and `label` columns")
+    parser.add_argument("--target-agreement", type=float, default=0.99)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    sample = labelled_paths(args.input, args.manifest)
+    if not sample:
+        raise SystemExit("No labelled drawings found")
+
+    images, labels = [], []
+    for path, label in sample:
+        _, image, error = load_image(path)
+        if image is None:
+            print(f"Skipping {path}: {error}")
+            continue
+        images.append(image)
+        labels.append(label)
+    batch, labels = np.stack(images), np.array(labels)
+    print(f"{len(batch)} labelled drawing(s)")
+
+    from utils.inference import EARLY_EXIT_MODEL, ENSEMBLE, predict_ensemble
+
+    per_model = {name: [] for name in ENSEMBLE}
+    for start in range(0, len(batch), args.batch_size):
+        _, preds = predict_ensemble(batch[start:start + args.batch_size])
+        for name in ENSEMBLE:
+            per_model[name].append(preds[name])
+    per_model = {name: np.concatenate(chunks) for name, chunks in per_model.items()}
+    full = np.mean([per_model[name] for name in ENSEMBLE], axis=0)
+    print(f"Full ensemble accuracy: {(full.argmax(axis=1) == labels).mean():.3f}")
+
+    rows = sweep(per_model[EARLY_EXIT_MODEL], full, labels)
+    eligible = [r for r in rows if r["agreement"] >= args.target_agreement]
+    if not eligible:
+        raise SystemExit(f"No thresholds reach {args.target_agreement:.1%} agreement on this sample")
+    best = max(eligible, key=lambda r: (r["exit_rate"], r["agreement"]))
+
+    print(f"Early exit with {EARLY_EXIT_MODEL}: {best['exit_rate']:.1%} of drawings, "
+          f"{best['agreement']:.2%} agreement, {best['accuracy']:.3f} accuracy")
+    print(f"DRAWEE_EARLY_EXIT_MIN_PROB={best['min_prob']}")
+    print(f"DRAWEE_EARLY_EXIT_MIN_MARGIN={best['min_margin']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+-- Pre-generated thumbnail for each analyzed drawing; the records page shows it instead
+-- of downloading the full-size image. Older rows keep NULL and fall back to image_path.
+alter table public.results
+    add column if not exists thumbnail_path text;
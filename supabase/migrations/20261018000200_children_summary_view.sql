@@ -0,0 +1,27 @@
+-- One row per child with its record count and latest predicted stage, so the Analyze
+-- page lists children in a single query instead of one count query per child.
+create index if not exists results_child_id_created_at_idx
+    on public.results (child_id, created_at desc);
+
+create or replace view public.children_summary
+with (security_invoker = true) as
+select
+    c.id,
+    c.user_id,
+    c.name,
+    coalesce(counts.record_count, 0) as record_count,
+    latest.prediction as latest_stage,
+    latest.created_at as latest_at
+from public.children c
+left join lateral (
+    select count(*) as record_count
+    from public.results r
+    where r.child_id = c.id
+) counts on true
+left join lateral (
+    select r.prediction, r.created_at
+    from public.results r
+    where r.child_id = c.id
+    order by r.created_at desc
+    limit 1
+) latest on true;
@@ -0,0 +1,19 @@
+-- Per-day stage counts for one child, used for the Child Records summary and chart
+-- so the page no longer downloads the child's full results history.
+create index if not exists results_child_id_created_at_id_idx
+    on public.results (child_id, created_at desc, id desc);
+
+create or replace function public.child_stage_summary(p_child_id uuid)
+returns table (day date, prediction text, count bigint)
+language sql
+stable
+as $$
+    select
+        (r.created_at at time zone 'Asia/Manila')::date as day,
+        r.prediction,
+        count(*) as count
+    from public.results r
+    where r.child_id = p_child_id
+    group by 1, 2
+    order by 1, 2;
+$$;
@@ -0,0 +1,67 @@
+-- Per child, per day (Asia/Manila), per stage counts maintained incrementally by a trigger
+-- on results, so the Child Records summary and chart read a small pre-aggregated series.
+create table if not exists public.child_stage_daily (
+    child_id uuid not null references public.children (id) on delete cascade,
+    day date not null,
+    prediction text not null,
+    count integer not null default 0,
+    primary key (child_id, day, prediction)
+);
+
+alter table public.child_stage_daily enable row level security;
+
+create policy "Owners can read their children's rollups"
+    on public.child_stage_daily for select
+    using (exists (
+        select 1 from public.children c
+        where c.id = child_stage_daily.child_id and c.user_id = auth.uid()
+    ));
+
+create or replace function public.results_stage_rollup()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if tg_op in ('DELETE', 'UPDATE') and old.child_id is not null then
+        update child_stage_daily
+           set count = count - 1
+         where child_id = old.child_id
+           and day = (old.created_at at time zone 'Asia/Manila')::date
+           and prediction = old.prediction;
+
+        delete from child_stage_daily
+         where child_id = old.child_id
+           and day = (old.created_at at time zone 'Asia/Manila')::date
+           and prediction = old.prediction
+           and count <= 0;
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') and new.child_id is not null then
+        insert into child_stage_daily (child_id, day, prediction, count)
+        values (new.child_id, (new.created_at at time zone 'Asia/Manila')::date, new.prediction, 1)
+        on conflict (child_id, day, prediction)
+        do update set count = child_stage_daily.count + 1;
+    end if;
+
+    return null;
+end;
+$$;
+
+drop trigger if exists results_stage_rollup on public.results;
+create trigger results_stage_rollup
+    after insert or delete or update of child_id, prediction, created_at
+    on public.results
+    for each row execute function public.results_stage_rollup();
+
+-- Backfill from existing rows
+insert into public.child_stage_daily (child_id, day, prediction, count)
+select r.child_id, (r.created_at at time zone 'Asia/Manila')::date, r.prediction, count(*)
+from public.results r
+where r.child_id is not null
+group by 1, 2, 3
+on conflict (child_id, day, prediction) do update set count = excluded.count;
+
+-- Replaced by the rollup table
+drop function if exists public.child_stage_summary(uuid);
@@ -0,0 +1,28 @@
+-- Transactional deletes that hand back the storage URLs of the removed drawings, so the
+-- caller can delete the objects in bulk instead of leaving them in the bucket forever.
+create or replace function public.delete_child_cascade(p_child_id uuid, p_user_id uuid)
+returns table (image_path text, thumbnail_path text)
+language plpgsql
+as $$
+begin
+    if not exists (select 1 from public.children where id = p_child_id and user_id = p_user_id) then
+        return;
+    end if;
+
+    return query
+        delete from public.results r
+        where r.child_id = p_child_id
+        returning r.image_path, r.thumbnail_path;
+
+    delete from public.children where id = p_child_id and user_id = p_user_id;
+end;
+$$;
+
+create or replace function public.delete_results(p_ids uuid[], p_user_id uuid)
+returns table (image_path text, thumbnail_path text)
+language sql
+as $$
+    delete from public.results r
+    where r.id = any(p_ids) and r.user_id = p_user_id
+    returning r.image_path, r.thumbnail_path;
+$$;
@@ -0,0 +1,5 @@
+-- Penultimate-layer embedding of each analyzed drawing, as raw float16 bytes (2 bytes per
+-- dimension), for the "similar drawings" search. NULL for rows analyzed before this column
+-- existed, or served from the prediction cache; scripts/backfill_embeddings.py fills them in.
+alter table public.results
+    add column if not exists embedding bytea;
@@ -0,0 +1,15 @@
+-- Grad-CAM overlays, keyed by the perceptual hash of the analyzed drawing, so a drawing
+-- (or a re-upload of it) is explained once. Written by the app's background worker with
+-- the service role; results.image_hash links each record to its heatmap.
+alter table public.results
+    add column if not exists image_hash text;
+
+create table if not exists public.heatmaps (
+    image_hash text primary key,
+    stage text not null,
+    path text not null,
+    created_at timestamptz not null default now()
+);
+
+-- No policies: only the service role reads and writes heatmaps
+alter table public.heatmaps enable row level security;
@@ -0,0 +1,86 @@
+-- Heatmaps become per user and are keyed by the SHA-256 of the stored drawing instead of
+-- its perceptual hash: a pHash match across users leaked one user's overlay to another,
+-- and a near-duplicate is not the same drawing. Overlays move to heatmaps/<user id>/.
+-- Existing rows can't be re-keyed, so they are dropped; their objects under heatmaps/
+-- are removed by scripts/reconcile_storage.py.
+drop table if exists public.heatmaps;
+
+create table public.heatmaps (
+    user_id uuid not null,
+    image_hash text not null,
+    stage text not null,
+    path text not null,
+    created_at timestamptz not null default now(),
+    primary key (user_id, image_hash)
+);
+
+-- No policies: only the service role reads and writes heatmaps
+alter table public.heatmaps enable row level security;
+
+comment on column public.results.image_hash is
+    'SHA-256 (hex) of the stored drawing; with user_id, the key of its row in public.heatmaps';
+
+-- The delete RPCs also remove heatmaps no remaining result of the user refers to, and
+-- return their paths (one row each, heatmap_path set) along with the drawings' URLs.
+drop function if exists public.delete_child_cascade(uuid, uuid);
+drop function if exists public.delete_results(uuid[], uuid);
+
+create function public.delete_child_cascade(p_child_id uuid, p_user_id uuid)
+returns table (image_path text, thumbnail_path text, heatmap_path text)
+language plpgsql
+as $$
+declare
+    v_hashes text[];
+begin
+    if not exists (select 1 from public.children where id = p_child_id and user_id = p_user_id) then
+        return;
+    end if;
+
+    select array_agg(distinct r.image_hash) into v_hashes
+    from public.results r
+    where r.child_id = p_child_id;
+
+    return query
+        delete from public.results r
+        where r.child_id = p_child_id
+        returning r.image_path, r.thumbnail_path, null::text;
+
+    delete from public.children where id = p_child_id and user_id = p_user_id;
+
+    return query
+        delete from public.heatmaps h
+        where h.user_id = p_user_id and h.image_hash = any(v_hashes)
+          and not exists (
+              select 1 from public.results r
+              where r.user_id = p_user_id and r.image_hash = h.image_hash
+          )
+        returning null::text, null::text, h.path;
+end;
+$$;
+
+create function public.delete_results(p_ids uuid[], p_user_id uuid)
+returns table (image_path text, thumbnail_path text, heatmap_path text)
+language plpgsql
+as $$
+declare
+    v_hashes text[];
+begin
+    select array_agg(distinct r.image_hash) into v_hashes
+    from public.results r
+    where r.id = any(p_ids) and r.user_id = p_user_id;
+
+    return query
+        delete from public.results r
+        where r.id = any(p_ids) and r.user_id = p_user_id
+        returning r.image_path, r.thumbnail_path, null::text;
+
+    return query
+        delete from public.heatmaps h
+        where h.user_id = p_user_id and h.image_hash = any(v_hashes)
+          and not exists (
+              select 1 from public.results r
+              where r.user_id = p_user_id and r.image_hash = h.image_hash
+          )
+        returning null::text, null::text, h.path;
+end;
+$$;
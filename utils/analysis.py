@@ -0,0 +1,50 @@
+"""
+Entry point to the inference stack (OpenCV, TensorFlow and the models).
+
+Pages import this lazily, only once an analysis starts, so login screens and children
+lists never wait for it. utils.models.warm_up_in_background() also preloads it at start-up.
+"""
+import numpy as np
+
+from utils.batcher import get_worker
+from utils.inference import early_exit_stats, predict_in_batches
+from utils.phash_cache import cached_predict, get_prediction_cache
+from utils.preprocess import stack_batch
+
+
+def preprocess_images(images) -> np.ndarray:
+    """
+    Resize decoded PIL images into one contiguous uint8 batch.
+    """
+    return stack_batch([np.asarray(im) for im in images])
+
+
+def analyze(batch: np.ndarray, trace=None, features: dict = None, user_id: str = None, progress=None):
+    """
+    Interactive path: cache lookup, then micro-batched with concurrent sessions' requests.
+    Returns (preds, cache_hits); per-image embeddings go to `features["embedding"]`.
+    `progress(stage)` is called after each stage: "cache_lookup", then for cache misses
+    "queued", "predicting" and "predicted".
+    """
+    return cached_predict(
+        batch, lambda misses, out: get_worker().predict(misses, trace=trace, features=out, progress=progress),
+        trace=trace, features=features, user_id=user_id, progress=progress
+    )
+
+
+def analyze_batch(batch: np.ndarray, features: dict = None, user_id: str = None):
+    """
+    Bulk path: cache lookup, then the misses in chunks of MAX_BATCH_SIZE.
+    Returns (preds, cache_hits); per-image embeddings go to `features["embedding"]`.
+    """
+    return cached_predict(
+        batch, lambda misses, out: predict_in_batches(misses, features=out), features=features, user_id=user_id
+    )
+
+
+def runtime_stats() -> dict:
+    return {
+        "inference_worker": get_worker().stats(),
+        "prediction_cache": get_prediction_cache().stats(),
+        "early_exit": early_exit_stats(),
+    }
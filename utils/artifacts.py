@@ -0,0 +1,214 @@
+"""
+Model artifact manager: fetches weight files into the local cache with checksum
+verification and atomic writes, from a local mirror directory or Google Drive.
+
+Expected SHA-256 digests come from the lock file (DRAWEE_MODEL_LOCK, written by
+`python -m scripts.fetch_models --pin`). An artifact that isn't pinned is trusted on first
+download only if it is structurally complete (an HDF5 file that opens, or a .keras zip
+whose members all pass their CRC), and its digest is then kept in a `<file>.sha256`
+sidecar so later corruption is still caught. A cached file with neither a pin nor a sidecar (e.g. a partial download from
+before checksums) is never trusted: it is fetched again, or rejected if it can't be.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import zipfile
+
+CACHE_DIR = os.environ.get("DRAWEE_MODEL_CACHE", "model_cache")
+# Directory (e.g. a mounted share) checked before the network
+MIRROR_DIR = os.environ.get("DRAWEE_MODEL_MIRROR")
+# Never touch the network; artifacts must already be in the cache or mirror
+OFFLINE = os.environ.get("DRAWEE_OFFLINE", "") == "1"
+LOCK_FILE = os.environ.get("DRAWEE_MODEL_LOCK", "models.lock.json")
+
+logger = logging.getLogger(__name__)
+
+_status = {}
+_digests = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class ArtifactError(RuntimeError):
+    pass
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_lock() -> dict:
+    if not os.path.exists(LOCK_FILE):
+        return {}
+    with open(LOCK_FILE) as f:
+        return json.load(f)
+
+
+def write_sidecar(path: str) -> str:
+    """
+    Record the digest of a file this machine produced itself (e.g. the fused ensemble).
+    """
+    digest = sha256_file(path)
+    tmp = f"{path}.sha256.tmp"
+    with open(tmp, "w") as f:
+        f.write(digest)
+    os.replace(tmp, path + ".sha256")
+    return digest
+
+
+def _expected_sha256(filename: str, path: str):
+    pinned = load_lock().get(filename)
+    if pinned:
+        return pinned
+    sidecar = path + ".sha256"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return f.read().strip()
+    return None
+
+
+def has_expected_digest(filename: str) -> bool:
+    """
+    Whether a pin or a sidecar vouches for the cached copy of `filename`.
+    """
+    return _expected_sha256(filename, os.path.join(CACHE_DIR, filename)) is not None
+
+
+def _check_complete(path: str, filename: str):
+    """
+    Reject a truncated or corrupt download that no pin can catch.
+    """
+    if filename.endswith(".h5"):
+        import h5py
+        try:
+            with h5py.File(path, "r") as f:
+                f.visit(lambda name: None)
+        except Exception as e:
+            raise ArtifactError(f"{filename} is not a readable HDF5 file: {e}") from e
+    elif filename.endswith(".keras"):
+        try:
+            with zipfile.ZipFile(path) as f:
+                bad = f.testzip()
+        except zipfile.BadZipFile as e:
+            raise ArtifactError(f"{filename} is not a readable .keras archive: {e}") from e
+        if bad:
+            raise ArtifactError(f"{filename} is corrupt ({bad} fails its CRC check)")
+    elif os.path.getsize(path) == 0:
+        raise ArtifactError(f"{filename} is empty")
+
+
+def _verified(path: str, expected: str) -> bool:
+    actual = sha256_file(path)
+    if actual != expected:
+        logger.error("Checksum mismatch for %s: expected %s, got %s", path, expected, actual)
+        return False
+    return True
+
+
+def _fetch_to(tmp_path: str, filename: str, file_id: str):
+    mirror_path = os.path.join(MIRROR_DIR, filename) if MIRROR_DIR else None
+    if mirror_path and os.path.exists(mirror_path):
+        shutil.copyfile(mirror_path, tmp_path)
+        return
+    if OFFLINE:
+        raise ArtifactError(f"{filename} is not in the cache or mirror and DRAWEE_OFFLINE=1")
+    if not file_id:
+        raise ArtifactError(f"{filename} not found; it has no download source")
+
+    import gdown
+    url = f"https://drive.google.com/uc?id={file_id}"
+    if gdown.download(url, tmp_path, quiet=True) is None:
+        raise ArtifactError(f"Download of {filename} failed")
+
+
+def ensure_artifact(filename: str, file_id: str = None) -> str:
+    """
+    Return the local path of a verified artifact, fetching it first if needed.
+    The file only appears under its final name once complete and verified.
+    """
+    with _locks_guard:
+        lock = _locks.setdefault(filename, threading.Lock())
+
+    path = os.path.join(CACHE_DIR, filename)
+    with lock:
+        if _status.get(filename) == "ready" and os.path.exists(path):
+            return path
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        expected = _expected_sha256(filename, path)
+
+        if os.path.exists(path):
+            if expected is None:
+                # Nothing vouches for this file; it is only replaced once a fresh copy is complete
+                logger.warning("%s has no pinned or recorded checksum; fetching it again", path)
+            elif _verified(path, expected):
+                _status[filename] = "ready"
+                _digests[filename] = expected
+                return path
+            else:
+                os.remove(path)
+
+        _status[filename] = "fetching"
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            try:
+                _fetch_to(tmp_path, filename, file_id)
+            except ArtifactError as e:
+                if os.path.exists(path) and expected is None:
+                    raise ArtifactError(f"{path} can't be verified (no pin or .sha256 sidecar) and {e}") from e
+                raise
+            actual = sha256_file(tmp_path)
+            if expected and actual != expected:
+                raise ArtifactError(f"Checksum mismatch for {filename}: expected {expected}, got {actual}")
+            if not expected:
+                _check_complete(tmp_path, filename)
+                logger.warning("%s is not pinned in %s; trusting this download (sha256 %s)", filename, LOCK_FILE, actual)
+            os.replace(tmp_path, path)
+            if not expected:
+                write_sidecar(path)
+        except Exception as e:
+            _status[filename] = f"failed: {e}"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        _status[filename] = "ready"
+        _digests[filename] = actual
+        logger.info("Fetched %s (sha256 %s)", filename, actual)
+        return path
+
+
+def artifact_status(filename: str) -> str:
+    """
+    "ready", "fetching", "failed: ..." or "pending" (not checked yet in this process).
+    """
+    return _status.get(filename, "pending")
+
+
+def artifact_digest(filename: str) -> str:
+    """
+    SHA-256 of the verified artifact, once ensure_artifact has checked it in this process.
+    """
+    return _digests.get(filename)
+
+
+def prefetch(artifacts: dict) -> dict:
+    """
+    Ensure every {filename: file_id} artifact is cached. Failures are logged and
+    returned as {filename: error}, not raised.
+    """
+    failures = {}
+    for filename, file_id in artifacts.items():
+        try:
+            ensure_artifact(filename, file_id)
+        except Exception as e:
+            logger.error("Prefetch of %s failed: %s", filename, e)
+            failures[filename] = str(e)
+    return failures
@@ -1,26 +1,257 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+import httpx
 import streamlit as st
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
 # Load Supabase credentials from secrets.toml
 SUPABASE_URL = st.secrets["connections"]["supabase"]["SUPABASE_URL"]
 SUPABASE_ANON_KEY = st.secrets["connections"]["supabase"]["SUPABASE_ANON_KEY"]
 SUPABASE_SERVICE_ROLE_KEY = st.secrets["connections"]["supabase"]["SUPABASE_SERVICE_ROLE_KEY"]
-# cookie_secret = st.secrets["cookie_password"]
+# Without a cookie password, logins last only as long as the browser session
+COOKIE_PASSWORD = st.secrets.get("cookie_password")
+COOKIE_PREFIX = "drawee/"
+COOKIE_NAME = "refresh_token"
+
+# Connection pool shared by every client in the process (keep-alive, so TLS handshakes are reused)
+POOL_SIZE = int(os.environ.get("DRAWEE_SUPABASE_POOL_SIZE", 20))
+HTTP_TIMEOUT = float(os.environ.get("DRAWEE_SUPABASE_TIMEOUT", 10))
+# Access tokens are refreshed this many seconds before they expire: in the background, or
+# on the next rerun when the refresh token is kept in a cookie
+REFRESH_MARGIN = int(os.environ.get("DRAWEE_AUTH_REFRESH_MARGIN", 300))
+REFRESH_RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint latency counters, e.g. "GET rest/results"
+_latency = defaultdict(lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+_latency_lock = threading.Lock()
+_admin_client = None
+_admin_client_lock = threading.Lock()
+# The pool itself. Each client wraps it in its own httpx.Client, because supabase-py sets
+# the signed-in user's headers on the client it is given
+_transport = httpx.HTTPTransport(limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE))
+
+
+def _on_request(request: httpx.Request):
+    request.extensions["drawee_start"] = time.perf_counter()
+
+
+def _on_response(response: httpx.Response):
+    request = response.request
+    start = request.extensions.get("drawee_start")
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    # /rest/v1/results?... -> "rest/results", /storage/v1/object/... -> "storage/object"
+    parts = request.url.path.strip("/").split("/")
+    endpoint = "/".join(parts[0:1] + parts[2:3])
+    with _latency_lock:
+        counter = _latency[f"{request.method} {endpoint}"]
+        counter["calls"] += 1
+        counter["errors"] += response.status_code >= 400
+        counter["total_ms"] += elapsed_ms
+        counter["max_ms"] = max(counter["max_ms"], elapsed_ms)
+
+
+def _client_options(**auth_options) -> ClientOptions:
+    # Never closed: closing it would close the shared transport, and it holds no connections of its own
+    http_client = httpx.Client(
+        transport=_transport,
+        timeout=HTTP_TIMEOUT,
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+    try:
+        return ClientOptions(
+            httpx_client=http_client,
+            postgrest_client_timeout=HTTP_TIMEOUT,
+            storage_client_timeout=HTTP_TIMEOUT,
+            **auth_options,
+        )
+    except TypeError:
+        # Older supabase-py can't take a custom httpx client; reusing the Client still
+        # reuses its internal keep-alive sessions, only the counters are unavailable
+        return ClientOptions(postgrest_client_timeout=HTTP_TIMEOUT, storage_client_timeout=HTTP_TIMEOUT, **auth_options)
+
+
+def supabase_latency_stats() -> dict:
+    """
+    Calls, errors, mean and max latency per Supabase endpoint since the process started.
+    """
+    with _latency_lock:
+        return {
+            endpoint: {**c, "mean_ms": c["total_ms"] / c["calls"] if c["calls"] else 0.0}
+            for endpoint, c in sorted(_latency.items())
+        }
+
+
+# --- Per-browser sessions ---
+def _user_info(user) -> dict:
+    return {
+        "id": user.id,
+        "email": user.email,
+        "username": user.user_metadata.get("username", "") if user.user_metadata else ""
+    }
+
+
+class AuthSession:
+    """
+    One browser session's Supabase client and tokens, kept in st.session_state.
+    Without a login cookie, the refresher thread swaps in new tokens and page reruns only
+    read them. With one, a rerun refreshes once the token is due (see is_authenticated):
+    Supabase refresh tokens are single-use, so a refresh the cookie never hears of would
+    leave it holding a revoked token.
+    """
+    def __init__(self):
+        # Token refresh is ours (see _TokenRefresher), not the client's own timer
+        self.client = create_client(
+            SUPABASE_URL, SUPABASE_ANON_KEY,
+            options=_client_options(auto_refresh_token=False, persist_session=False)
+        )
+        self.session = None
+        self.user = None
+        self.refresh_at = None
+        # Last refresh token written to the login cookie
+        self.cookie_token = None
+        self.lock = threading.Lock()
+
+    def set(self, session):
+        with self.lock:
+            self.session = session
+            if session.user:
+                self.user = _user_info(session.user)
+            expires_at = session.expires_at or time.time() + (session.expires_in or 3600)
+            self.refresh_at = expires_at - REFRESH_MARGIN
+        if not COOKIE_PASSWORD:
+            _refresher.schedule(self, self.refresh_at)
+
+    def clear(self):
+        with self.lock:
+            self.session = None
+            self.user = None
+            self.refresh_at = None
+
+    def refresh_due(self) -> bool:
+        return self.refresh_at is not None and self.refresh_at <= time.time()
+
+    def expired(self) -> bool:
+        return self.refresh_at is not None and self.refresh_at + REFRESH_MARGIN <= time.time()
+
+    def refresh(self):
+        with self.lock:
+            refresh_token = self.session.refresh_token if self.session else None
+        if refresh_token:
+            self.set(self.client.auth.refresh_session(refresh_token).session)
+
+
+class _TokenRefresher:
+    """
+    Process-wide daemon thread that refreshes every live session shortly before its token expires.
+    Sessions are held weakly, so a closed browser tab drops out on its own.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, auth_session: AuthSession, due: float):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), weakref.ref(auth_session)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="drawee-token-refresh", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                due, _, ref = heapq.heappop(self._heap)
+
+            auth_session = ref()
+            # Gone, logged out, or superseded by a later refresh
+            if auth_session is None or auth_session.refresh_at != due:
+                continue
+            try:
+                auth_session.refresh()
+            except Exception as e:
+                logger.warning("Token refresh failed, retrying in %ss: %s", REFRESH_RETRY_SECONDS, e)
+                if not auth_session.expired():
+                    auth_session.refresh_at = time.time() + REFRESH_RETRY_SECONDS
+                    self.schedule(auth_session, auth_session.refresh_at)
+
+
+_refresher = _TokenRefresher()
+
+
+def _auth_session() -> AuthSession:
+    if "auth" not in st.session_state:
+        st.session_state["auth"] = AuthSession()
+    return st.session_state["auth"]
+
+
+def _cookies():
+    """
+    This run's encrypted cookie manager, or None when persistent login is not configured.
+    """
+    if not COOKIE_PASSWORD:
+        return None
+    from streamlit_cookies_manager import EncryptedCookieManager
+
+    cookies = EncryptedCookieManager(prefix=COOKIE_PREFIX, password=COOKIE_PASSWORD)
+    if not cookies.ready():
+        # The component reports the browser's cookies and triggers a rerun
+        st.stop()
+    st.session_state["cookies"] = cookies
+    return cookies
+
+
+def _sync_cookie(auth_session: AuthSession):
+    """
+    Write the current refresh token to the login cookie (or delete it), if it changed.
+    """
+    cookies = st.session_state.get("cookies")
+    if cookies is None:
+        return
+    token = auth_session.session.refresh_token if auth_session.session else None
+    if token == auth_session.cookie_token:
+        return
+    if token:
+        cookies[COOKIE_NAME] = token
+    elif COOKIE_NAME in cookies:
+        del cookies[COOKIE_NAME]
+    cookies.save()
+    auth_session.cookie_token = token
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
 def get_supabase_admin_client() -> Client:
-    if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
-        return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-    return None
+    """
+    Process-wide service-role client, created once and reused by every session and rerun.
+    """
+    global _admin_client
+    if not (SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY):
+        return None
+    if _admin_client is None:
+        with _admin_client_lock:
+            if _admin_client is None:
+                _admin_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, options=_client_options())
+    return _admin_client
 
 def signup(email: str, password: str):
     """
     Create a new user using Supabase Auth and return the result object.
     """
     try:
-        result = supabase.auth.sign_up({
+        result = _auth_session().client.auth.sign_up({
             "email": email,
             "password": password
         })
@@ -35,25 +266,23 @@ def signup(email: str, password: str):
 def login(email: str, password: str) -> bool:
     """
     Login with email and password using Supabase Auth.
-    Stores user data as a dictionary in st.session_state["user"].
+    Stores user data as a dictionary in st.session_state["user"] and remembers the
+    login in an encrypted cookie.
     """
+    auth_session = _auth_session()
     try:
-        result = supabase.auth.sign_in_with_password({
+        result = auth_session.client.auth.sign_in_with_password({
             "email": email,
             "password": password
         })
 
         if result.session and result.user:
-            # Extract relevant user details
-            user_info = {
-                "id": result.user.id,
-                "email": result.user.email,
-                "username": result.user.user_metadata.get("username", "")  # optional
-            }
+            auth_session.set(result.session)
+            _sync_cookie(auth_session)
 
             # Store session and user info in session_state
             st.session_state["session"] = result.session
-            st.session_state["user"] = user_info
+            st.session_state["user"] = auth_session.user
 
             return True
     except Exception as e:
@@ -64,38 +293,57 @@ def login(email: str, password: str) -> bool:
 def is_authenticated() -> bool:
     """
     Check if the user is authenticated.
-    Restores session if available.
-    """
-    if "user" in st.session_state:
-        return True
-
-    # Try restoring session
-    session_info = supabase.auth.get_session()
-    if session_info and session_info.user:
-        user = session_info.user
-        user_info = {
-            "id": user.id,
-            "email": user.email,
-            "username": user.user_metadata.get("username", "") if user.user_metadata else ""
-        }
-        st.session_state["session"] = session_info
-        st.session_state["user"] = user_info
-        return True
+    Restores the login from the cookie once per browser session. After that, tokens are
+    refreshed in the background, or with a login cookie by the first rerun after they are
+    due, so the cookie is updated in the same run.
+    """
+    auth_session = _auth_session()
+    cookies = _cookies()
 
-    return False
+    if auth_session.user is None and cookies is not None and cookies.get(COOKIE_NAME):
+        auth_session.cookie_token = cookies[COOKIE_NAME]
+        try:
+            auth_session.set(auth_session.client.auth.refresh_session(cookies[COOKIE_NAME]).session)
+        except Exception as e:
+            logger.info("Could not restore login from cookie: %s", e)
+    elif auth_session.expired() or (cookies is not None and auth_session.refresh_due()):
+        # Without a cookie, only when background refresh kept failing until the token ran out
+        try:
+            auth_session.refresh()
+        except Exception as e:
+            if auth_session.expired():
+                logger.info("Session expired: %s", e)
+                auth_session.clear()
+            else:
+                logger.warning("Token refresh failed, retrying on the next run: %s", e)
+
+    _sync_cookie(auth_session)
+    if auth_session.user is None:
+        st.session_state.pop("user", None)
+        return False
+
+    st.session_state["session"] = auth_session.session
+    st.session_state["user"] = auth_session.user
+    return True
 
 def logout():
     """
-    Log the user out and clear session.
+    Log the user out, forget the login cookie and clear session.
     """
+    auth_session = _auth_session()
     try:
-        supabase.auth.sign_out()
+        auth_session.client.auth.sign_out()
     except Exception as e:
         st.warning(f"Logout failed: {e}")
-    st.session_state.clear()
+    auth_session.clear()
+    _sync_cookie(auth_session)
+    # Keep the cookie manager's pending writes, so the deletion still reaches the browser
+    for key in list(st.session_state):
+        if not key.startswith("CookieManager."):
+            del st.session_state[key]
 
 def get_supabase_client():
     """
-    Get Supabase client with anon key.
+    Get this browser session's Supabase client (anon key, signed in as the current user).
     """
-    return supabase
+    return _auth_session().client
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from utils.artifacts import sha256_file
+
+# keras | tflite-fp16 | tflite-int8 | onnx
+BACKEND = os.environ.get("DRAWEE_BACKEND", "keras")
+
+ARTIFACT_SUFFIXES = {
+    "tflite-fp16": ".fp16.tflite",
+    "tflite-int8": ".int8.tflite",
+    "onnx": ".onnx",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def artifact_path(h5_path: str, backend: str) -> str:
+    """
+    Path of the converted artifact for a reference .h5 model, e.g. drawee-resnet.int8.tflite.
+    """
+    if backend == "keras":
+        return h5_path
+    return os.path.splitext(h5_path)[0] + ARTIFACT_SUFFIXES[backend]
+
+
+def parity_report_path(path: str) -> str:
+    return path + ".parity.json"
+
+
+# --- Backends ---
+# Every backend mimics the bit of the Keras API callers use: predict(batch, **kwargs).
+# Backends that can also return penultimate-layer features implement predict_with_features.
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path: str):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(path)
+        self._features_model = None
+        self._features_lock = threading.Lock()
+
+    def predict(self, batch: np.ndarray, **kwargs):
+        kwargs.setdefault("verbose", 0)
+        return self.model.predict(batch, **kwargs)
+
+    def predict_with_features(self, batch: np.ndarray, **kwargs):
+        """
+        (penultimate-layer features, probabilities) from a single forward pass.
+        """
+        if self._features_model is None:
+            with self._features_lock:
+                if self._features_model is None:
+                    from tensorflow import keras
+                    self._features_model = keras.Model(self.model.inputs, [self.model.layers[-2].output, self.model.output])
+        kwargs.setdefault("verbose", 0)
+        features, probs = self._features_model.predict(batch, **kwargs)
+        return features, probs
+
+
+class TFLiteBackend:
+    def __init__(self, path: str, name: str = "tflite"):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.name = name
+        self.interpreter = Interpreter(model_path=path, num_threads=os.cpu_count())
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+        # An Interpreter is not thread-safe and batch mode calls it from script threads
+        self._lock = threading.Lock()
+
+    def predict(self, batch: np.ndarray, **kwargs) -> np.ndarray:
+        with self._lock:
+            return self._invoke(batch)
+
+    def _invoke(self, batch: np.ndarray) -> np.ndarray:
+        if self._batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self._input["index"], (len(batch),) + batch.shape[1:])
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+
+        scale, zero_point = self._input["quantization"]
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+        self.interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"]))
+        self.interpreter.invoke()
+
+        out = self.interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend needs `pip install onnxruntime`") from e
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray, **kwargs) -> np.ndarray:
+        return self.session.run(None, {self._input_name: batch.astype(np.float32)})[0]
+
+
+def _check_parity(path: str, h5_path: str):
+    report_path = parity_report_path(path)
+    if not os.path.exists(report_path):
+        raise RuntimeError(f"No parity report for {path}; run scripts/convert_models.py")
+    with open(report_path) as f:
+        report = json.load(f)
+    if not report.get("passed"):
+        raise RuntimeError(f"{path} failed its parity check: {report}")
+    # A report only vouches for the weights it was checked against
+    if report.get("source_sha256") != sha256_file(h5_path):
+        raise RuntimeError(f"{path} was converted from different weights than {h5_path}; re-run scripts/convert_models.py")
+    if report.get("artifact_sha256") != sha256_file(path):
+        raise RuntimeError(f"{path} changed after its parity check; re-run scripts/convert_models.py")
+
+
+def open_artifact(path: str, backend: str):
+    """
+    Open a converted artifact without checking parity (used by the conversion script).
+    """
+    if backend == "onnx":
+        return OnnxBackend(path)
+    return TFLiteBackend(path, name=backend)
+
+
+def load_backend(h5_path: str, backend: str = None):
+    """
+    Load a model through the configured backend.
+
+    Converted artifacts are only used when their parity check against the reference .h5
+    passed; otherwise this logs the reason and falls back to Keras so predictions never
+    change silently.
+    """
+    backend = backend or BACKEND
+    if backend != "keras" and backend not in ARTIFACT_SUFFIXES:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    if backend != "keras":
+        path = artifact_path(h5_path, backend)
+        try:
+            _check_parity(path, h5_path)
+            return open_artifact(path, backend)
+        except Exception as e:
+            logger.error("Falling back to Keras for %s: %s", h5_path, e)
+    return KerasBackend(h5_path)
@@ -0,0 +1,140 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils.inference import MAX_BATCH_SIZE, predict_serving
+
+BATCH_WINDOW_MS = float(os.environ.get("DRAWEE_BATCH_WINDOW_MS", 10))
+PICKUP_POLL_S = 0.01  # how often predict() checks whether its request left the queue
+
+logger = logging.getLogger(__name__)
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class InferenceWorker:
+    """
+    Coalesces concurrent single-image requests from all sessions into micro-batches.
+    """
+
+    def __init__(self, predict_fn=None, max_batch_size: int = MAX_BATCH_SIZE, window_ms: float = BATCH_WINDOW_MS):
+        # predict_fn(batch, timings, features) -> probabilities; timings collects stage
+        # durations in ms and features the batch's embeddings, when the models provide them
+        self.predict_fn = predict_fn or (lambda batch, timings, features: predict_serving(batch, timings, features)[0])
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._total_wait = 0.0
+        self._thread = threading.Thread(target=self._run, name="drawee-inference-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray, trace=None) -> Future:
+        """
+        Queue one preprocessed uint8 image; the future resolves to (probability row, embedding or None).
+        If a Trace is given, the queue wait and the micro-batch's model stages are added to it.
+        """
+        future = Future()
+        self._queue.put((image, future, time.perf_counter(), trace))
+        return future
+
+    def predict(self, batch: np.ndarray, timeout: float = None, trace=None, features: dict = None,
+                progress=None) -> np.ndarray:
+        """
+        Blocking helper: submit every image of `batch` and return their rows stacked.
+        If `features` is given and every image got an embedding, they are stored under "embedding".
+        `progress(stage)` is called from this thread with "queued", "predicting" (the worker took
+        every image) and "predicted".
+        """
+        futures = [self.submit(image, trace) for image in batch]
+        if progress is not None:
+            progress("queued")
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            while not all(f.running() or f.done() for f in futures):
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+                time.sleep(PICKUP_POLL_S)
+            progress("predicting")
+        results = [f.result(timeout=timeout) for f in futures]
+        if progress is not None:
+            progress("predicted")
+        if features is not None and all(embedding is not None for _, embedding in results):
+            features["embedding"] = np.stack([embedding for _, embedding in results])
+        return np.stack([row for row, _ in results])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": batches,
+                "mean_batch_size": self._requests / batches if batches else 0.0,
+                "mean_queue_wait_ms": 1000 * self._total_wait / self._requests if self._requests else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            }
+
+    def _collect(self) -> list:
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            for _, future, _, _ in items:
+                future.set_running_or_notify_cancel()
+            with self._stats_lock:
+                self._batch_sizes[len(items)] += 1
+                self._requests += len(items)
+                self._total_wait += sum(started - queued for _, _, queued, _ in items)
+
+            timings, features = {}, {}
+            try:
+                preds = self.predict_fn(np.stack([image for image, _, _, _ in items]), timings, features)
+            except Exception as e:
+                logger.exception("Micro-batch of %d failed", len(items))
+                for _, future, _, _ in items:
+                    future.set_exception(e)
+                continue
+
+            traces = {id(trace): (trace, queued) for _, _, queued, trace in items if trace is not None}
+            for trace, queued in traces.values():
+                trace.add("queue_wait", (started - queued) * 1000, queued)
+                for stage, ms in timings.items():
+                    trace.add(stage, ms)
+                trace.fields["micro_batch_size"] = len(items)
+
+            embeddings = features.get("embedding")
+            for i, ((_, future, _, _), row) in enumerate(zip(items, preds)):
+                future.set_result((row, embeddings[i] if embeddings is not None else None))
+
+
+def get_worker() -> InferenceWorker:
+    """
+    Process-wide inference worker shared by every Streamlit session.
+    """
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = InferenceWorker()
+    return _worker
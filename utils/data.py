@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Per-user read cache for lookups that every rerun repeats. Entries expire after the TTL
+# and are dropped explicitly by the write paths (see invalidate_user_cache).
+READ_CACHE_TTL = float(os.environ.get("DRAWEE_READ_CACHE_TTL", 300))
+# Most entries of one kind kept at once; the least recently used go first. Embedding
+# indexes hold every vector of a user, so far fewer of them are kept.
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("DRAWEE_READ_CACHE_MAX_ENTRIES", 1000))
+KIND_MAX_ENTRIES = {"embeddings": int(os.environ.get("DRAWEE_EMBEDDING_INDEX_CACHE_SIZE", 16))}
+
+# (user_id, kind) -> (expires_at, value), in LRU order
+_read_cache = OrderedDict()
+_read_cache_lock = threading.Lock()
+
+
+def cached_read(user_id: str, kind: str, loader):
+    """
+    The user's cached value of `kind`, or `loader()`'s result, cached for READ_CACHE_TTL.
+    """
+    now = time.monotonic()
+    with _read_cache_lock:
+        hit = _read_cache.get((user_id, kind))
+        if hit and hit[0] > now:
+            _read_cache.move_to_end((user_id, kind))
+            return hit[1]
+
+    value = loader()
+    with _read_cache_lock:
+        _read_cache[(user_id, kind)] = (now + READ_CACHE_TTL, value)
+        _read_cache.move_to_end((user_id, kind))
+        _evict(kind, now)
+    return value
+
+
+def _evict(kind: str, now: float):
+    """
+    Drop expired entries, then the least recently used of `kind` beyond its limit.
+    Called with _read_cache_lock held.
+    """
+    for key in [key for key, (expires_at, _) in _read_cache.items() if expires_at <= now]:
+        del _read_cache[key]
+    same_kind = [key for key in _read_cache if key[1] == kind]
+    for key in same_kind[:max(0, len(same_kind) - KIND_MAX_ENTRIES.get(kind, READ_CACHE_MAX_ENTRIES))]:
+        del _read_cache[key]
+
+
+def peek_cached(user_id: str, kind: str):
+    """
+    The user's cached value of `kind` if there is a live one, without loading it.
+    """
+    with _read_cache_lock:
+        hit = _read_cache.get((user_id, kind))
+    return hit[1] if hit and hit[0] > time.monotonic() else None
+
+
+def invalidate_user_cache(user_id: str, *kinds):
+    """
+    Drop cached reads for a user: the given kinds ("profile", "children",
+    "children_summary", "embeddings"), or everything when none are given.
+    """
+    with _read_cache_lock:
+        for key in list(_read_cache):
+            if key[0] == user_id and (not kinds or key[1] in kinds):
+                del _read_cache[key]
+
+
+def get_display_name(client, user_id: str, default: str = None) -> str:
+    def load():
+        resp = client.table("profiles").select("display_name").eq("id", user_id).execute()
+        return resp.data[0].get("display_name") if resp.data else None
+    return cached_read(user_id, "profile", load) or default
+
+
+def get_children(client, user_id: str) -> list:
+    """
+    A user's children as [{"id", "name"}], cached.
+    """
+    def load():
+        resp = client.table("children").select("id, name").eq("user_id", user_id).execute()
+        return resp.data or []
+    return cached_read(user_id, "children", load)
+
+
+def get_child_ids(client, user_id: str) -> dict:
+    """
+    Child name -> id (the first record wins when a name is duplicated).
+    """
+    ids = {}
+    for child in get_children(client, user_id):
+        ids.setdefault(child["name"], child["id"])
+    return ids
+
+
+def ensure_children(client, user_id: str, names) -> dict:
+    """
+    Map child names to ids for a user, creating any missing children in one insert.
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    if not names:
+        return {}
+
+    known = get_child_ids(client, user_id)
+    ids = {n: known[n] for n in names if n in known}
+
+    missing = [n for n in names if n not in ids]
+    if missing:
+        inserted = client.table("children").insert([
+            {"name": name, "user_id": user_id} for name in missing
+        ]).execute()
+        invalidate_user_cache(user_id, "children", "children_summary")
+        for child in inserted.data or []:
+            ids[child["name"]] = child["id"]
+
+    return ids
+
+
+def fetch_children_summary(client, user_id: str) -> list:
+    """
+    Every child of a user with id, name, record_count and latest_stage, in one query
+    against the children_summary view (cached).
+    """
+    def load():
+        resp = client.table("children_summary").select("id, name, record_count, latest_stage").eq("user_id", user_id).execute()
+        return resp.data or []
+    return cached_read(user_id, "children_summary", load)
+
+
+# --- Child records ---
+RECORDS_PAGE_SIZE = int(os.environ.get("DRAWEE_RECORDS_PAGE_SIZE", 20))
+RECORD_COLUMNS = "id, created_at, image_path, thumbnail_path, prediction, confidence, image_hash"
+
+
+def fetch_results_page(client, child_id: str, cursor=None, limit: int = RECORDS_PAGE_SIZE):
+    """
+    One page of a child's results, newest first, using keyset pagination on (created_at, id).
+    `cursor` is the (created_at, id) of the last row already shown. Returns (rows, next_cursor);
+    next_cursor is None on the last page.
+    """
+    query = client.table("results").select(RECORD_COLUMNS).eq("child_id", child_id)
+    if cursor:
+        created_at, last_id = cursor
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})')
+    resp = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+
+    rows = resp.data or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1]["created_at"], rows[-1]["id"])
+
+
+def fetch_stage_summary(client, child_id: str) -> list:
+    """
+    [{"day", "prediction", "count"}] for a child from the child_stage_daily rollup,
+    which triggers on results keep up to date.
+    """
+    resp = client.table("child_stage_daily").select("day, prediction, count").eq("child_id", child_id).order("day").execute()
+    return resp.data or []
+
+
+def fetch_heatmaps(client, user_id: str, image_hashes) -> dict:
+    """
+    Image hash -> Grad-CAM overlay URL, for the user's hashes that already have one (see utils.explain).
+    """
+    image_hashes = sorted({h for h in image_hashes if h})
+    if not image_hashes:
+        return {}
+    resp = (
+        client.table("heatmaps").select("image_hash, path")
+        .eq("user_id", user_id).in_("image_hash", image_hashes)
+        .execute()
+    )
+    return {row["image_hash"]: row["path"] for row in resp.data or []}
@@ -0,0 +1,77 @@
+import logging
+from urllib.parse import unquote, urlparse
+
+from utils.storage import BUCKET
+
+# Supabase Storage accepts up to 1000 paths per remove call; stay well below it
+REMOVE_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def storage_path_from_url(url: str):
+    """
+    Object path inside BUCKET for a public URL (None for anything else).
+    """
+    if not url:
+        return None
+    marker = f"/object/public/{BUCKET}/"
+    path = urlparse(url).path
+    if marker not in path:
+        return None
+    return unquote(path.split(marker, 1)[1])
+
+
+def remove_objects(client, paths) -> int:
+    """
+    Delete storage objects in batches; returns how many were removed. Failures are only
+    logged: whatever is left behind is picked up by scripts/reconcile_storage.py.
+    """
+    paths = sorted({p for p in paths if p})
+    removed = 0
+    bucket = client.storage.from_(BUCKET)
+    for start in range(0, len(paths), REMOVE_BATCH_SIZE):
+        batch = paths[start:start + REMOVE_BATCH_SIZE]
+        try:
+            bucket.remove(batch)
+            removed += len(batch)
+        except Exception as e:
+            logger.warning("Could not remove %d storage object(s): %s", len(batch), e)
+    return removed
+
+
+def _paths_from_rows(rows) -> list:
+    return [
+        storage_path_from_url(row.get(column))
+        for row in rows or []
+        for column in ("image_path", "thumbnail_path", "heatmap_path")
+    ]
+
+
+def _deleted_results(rows) -> int:
+    # The RPCs also return one row per removed heatmap, with only heatmap_path set
+    return sum(1 for row in rows or [] if not row.get("heatmap_path"))
+
+
+def delete_child(client, user_id: str, child_id: str, write_behind=None) -> int:
+    """
+    Delete a child, all of its results, their drawings and the heatmaps no other record of
+    the user shares. Rows go in one transactional RPC; the returned image URLs are then
+    removed from storage in bulk. Results of the child still waiting in `write_behind`
+    (a WriteBehindQueue) are dropped first, so none is written after the child is gone.
+    Returns the number of deleted results.
+    """
+    if write_behind is not None:
+        write_behind.cancel_child(user_id, child_id)
+    resp = client.rpc("delete_child_cascade", {"p_child_id": child_id, "p_user_id": user_id}).execute()
+    remove_objects(client, _paths_from_rows(resp.data))
+    return _deleted_results(resp.data)
+
+
+def delete_records(client, user_id: str, record_ids) -> int:
+    """
+    Delete results rows, their drawings and heatmaps; returns the number of deleted rows.
+    """
+    resp = client.rpc("delete_results", {"p_ids": list(record_ids), "p_user_id": user_id}).execute()
+    remove_objects(client, _paths_from_rows(resp.data))
+    return _deleted_results(resp.data)
@@ -0,0 +1,35 @@
+from utils.models import BACKBONES, INPUT_SHAPE, download_model
+from utils.preprocess import NORMALIZERS
+
+
+def build_fused_model(backbones: dict):
+    """
+    Merge the backbones into one graph with a shared input and an in-graph average.
+
+    Outputs a dict: "ensemble" holds the averaged probabilities, each backbone's own
+    probabilities are kept under its name for debugging, and its penultimate-layer
+    features under "<name>_features" for the embedding store.
+    """
+    from tensorflow import keras
+
+    if len({NORMALIZERS[name] for name in backbones}) != 1:
+        raise ValueError("Backbones use different normalizers and cannot share a fused input")
+
+    inputs = keras.Input(shape=INPUT_SHAPE, name="drawing")
+    outputs = {}
+    for name, model in backbones.items():
+        # Loaded .h5 models often share a default name; nested models need unique ones
+        branch = keras.Model(model.inputs, [model.layers[-2].output, model.output], name=name)
+        outputs[f"{name}_features"], outputs[name] = branch(inputs)
+
+    outputs["ensemble"] = keras.layers.Average(name="ensemble")([outputs[name] for name in backbones])
+    return keras.Model(inputs, outputs, name="drawee_ensemble")
+
+
+def build_from_registry():
+    """
+    Build the fused model from the registry's backbone .h5 files.
+    """
+    from tensorflow.keras.models import load_model
+
+    return build_fused_model({name: load_model(download_model(name)) for name in BACKBONES})
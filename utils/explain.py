@@ -0,0 +1,211 @@
+"""
+Grad-CAM explanations: where in a drawing the models looked for the predicted stage.
+
+Heatmaps are computed by a background worker after the result has been shown, for a
+micro-batch of drawings at a time and both backbones in one forward/backward pass. The
+overlay is stored as a small thumbnail under heatmaps/<user id>/<image hash> and recorded in
+the heatmaps table per user. The image hash is the SHA-256 of the stored drawing, so only an
+exact re-upload by the same user reuses an explanation, and the records page only reads the
+stored image.
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+import cv2
+
+from classes_def import classes
+from utils.backends import BACKEND
+from utils.data import fetch_heatmaps
+from utils.inference import ENSEMBLE, MAX_BATCH_SIZE
+from utils.models import EARLY_EXIT, fused_model_available, get_model
+from utils.preprocess import TARGET_SIZE, model_inputs
+from utils.storage import THUMBNAIL_SIZES, encode_image, upload_drawing
+
+# Grad-CAM needs the Keras models' gradients; with a converted backend there are no explanations
+EXPLANATIONS = os.environ.get("DRAWEE_EXPLANATIONS", "1") == "1" and BACKEND == "keras"
+# Background work: wait longer than the inference worker to fill a batch
+EXPLAIN_WINDOW_MS = float(os.environ.get("DRAWEE_EXPLAIN_WINDOW_MS", 500))
+HEATMAP_PREFIX = "heatmaps"
+HEATMAP_SIZE = THUMBNAIL_SIZES["thumbnail_path"]
+OVERLAY_ALPHA = 0.45
+
+logger = logging.getLogger(__name__)
+
+_gradcam_models = None
+_gradcam_lock = threading.Lock()
+_explainer = None
+_explainer_lock = threading.Lock()
+
+
+def _keras_backbones() -> dict:
+    """
+    The Keras model of each backbone, taken from the fused graph when that is what serves.
+    In early-exit mode the backbones serve, so the fused graph isn't loaded next to them.
+    """
+    if fused_model_available() and not EARLY_EXIT:
+        fused = get_model("ensemble")
+        return {name: fused.model.get_layer(name) for name in ENSEMBLE}
+    models = {name: get_model(name) for name in ENSEMBLE}
+    if not all(hasattr(m, "model") for m in models.values()):
+        raise RuntimeError("Grad-CAM needs the Keras backend")
+    return {name: m.model for name, m in models.items()}
+
+
+def _get_gradcam_models() -> dict:
+    """
+    Per backbone: (a model returning its last convolutional feature map and the input of its
+    classifier layer, that Dense layer). Grad-CAM differentiates the pre-softmax class score:
+    the softmax output saturates on confident drawings and mixes in the other classes.
+    """
+    global _gradcam_models
+    if _gradcam_models is None:
+        with _gradcam_lock:
+            if _gradcam_models is None:
+                from tensorflow import keras
+
+                built = {}
+                for name, model in _keras_backbones().items():
+                    conv = next(layer for layer in reversed(model.layers) if len(layer.output.shape) == 4)
+                    head = next(layer for layer in reversed(model.layers) if isinstance(layer, keras.layers.Dense))
+                    built[name] = (keras.Model(model.inputs, [conv.output, head.input]), head)
+                _gradcam_models = built
+    return _gradcam_models
+
+
+def gradcam(batch: np.ndarray, class_indices) -> np.ndarray:
+    """
+    Grad-CAM heatmaps in [0, 1] for a uint8 batch and one class per image, averaged over the
+    backbones. One tape covers every backbone, so the batch takes a single forward and
+    backward pass. Returns float32 (N, height, width) at the model input size.
+    """
+    import tensorflow as tf
+
+    models = _get_gradcam_models()
+    inputs = model_inputs(batch, tuple(models))
+    indices = tf.constant(np.stack([np.arange(len(batch)), np.asarray(class_indices)], axis=1))
+
+    with tf.GradientTape() as tape:
+        convs, scores = [], []
+        for name, (model, head) in models.items():
+            conv, pooled = model(inputs[name], training=False)
+            convs.append(conv)
+            logits = tf.matmul(pooled, head.kernel) + head.bias
+            # Each image's score only depends on its own feature map, so summing is safe
+            scores.append(tf.reduce_sum(tf.gather_nd(logits, indices)))
+        target = tf.add_n(scores)
+    grads = tape.gradient(target, convs)
+
+    heatmaps = np.zeros((len(batch), TARGET_SIZE[1], TARGET_SIZE[0]), dtype=np.float32)
+    for conv, grad in zip(convs, grads):
+        weights = tf.reduce_mean(grad, axis=(1, 2))
+        cam = tf.nn.relu(tf.einsum("nhwc,nc->nhw", conv, weights))
+        cam = cam / tf.maximum(tf.reduce_max(cam, axis=(1, 2), keepdims=True), 1e-12)
+        heatmaps += tf.image.resize(cam[..., None], TARGET_SIZE[::-1])[..., 0].numpy()
+    return heatmaps / len(convs)
+
+
+def image_hash(image_bytes: bytes) -> str:
+    """
+    Key of a drawing's heatmap: the SHA-256 of its stored (encoded) image, in hex.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def overlay(drawing, heatmap: np.ndarray):
+    """
+    The drawing (a PIL image) with a jet-coloured heatmap blended over it.
+    """
+    from PIL import Image
+
+    base = np.asarray(drawing.convert("RGB"), dtype=np.float32)
+    heat = cv2.resize(heatmap, (base.shape[1], base.shape[0]))
+    colour = cv2.cvtColor(cv2.applyColorMap(np.uint8(255 * heat), cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+    blended = (1 - OVERLAY_ALPHA) * base + OVERLAY_ALPHA * colour.astype(np.float32)
+    return Image.fromarray(blended.astype(np.uint8))
+
+
+class ExplanationWorker:
+    """
+    Computes and stores heatmaps in the background, a micro-batch at a time.
+    Best effort: a failure is logged and the record simply has no explanation.
+    """
+
+    def __init__(self, client, max_batch_size: int = MAX_BATCH_SIZE, window_ms: float = EXPLAIN_WINDOW_MS):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue()
+        # (user id, hash) pairs already explained or queued by this process
+        self._seen = set()
+        self._seen_lock = threading.Lock()
+        self._thread = None
+        if EXPLANATIONS:
+            self._thread = threading.Thread(target=self._run, name="drawee-explainer", daemon=True)
+            self._thread.start()
+
+    def submit(self, user_id: str, image_hash: str, image: np.ndarray, class_index: int, drawing):
+        """
+        Queue one analyzed drawing: its owner, hash, preprocessed uint8 image, predicted class and PIL image.
+        """
+        if not EXPLANATIONS:
+            return
+        with self._seen_lock:
+            if (user_id, image_hash) in self._seen:
+                return
+            self._seen.add((user_id, image_hash))
+        # Only a thumbnail-sized copy waits in the queue, not the full drawing
+        thumbnail = drawing.copy()
+        thumbnail.thumbnail((HEATMAP_SIZE, HEATMAP_SIZE))
+        self._queue.put((user_id, image_hash, image, int(class_index), thumbnail))
+
+    def _collect(self) -> list:
+        items = [self._queue.get()]
+        while len(items) < self.max_batch_size:
+            try:
+                items.append(self._queue.get(timeout=self.window))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                stored = set()
+                for user_id in {item[0] for item in items}:
+                    hashes = [item[1] for item in items if item[0] == user_id]
+                    stored.update((user_id, h) for h in fetch_heatmaps(self.client, user_id, hashes))
+                items = [item for item in items if item[:2] not in stored]
+                if items:
+                    self._explain(items)
+            except Exception:
+                logger.exception("Explaining %d drawing(s) failed", len(items))
+                # Let a later upload of the same drawing try again
+                with self._seen_lock:
+                    self._seen.difference_update(item[:2] for item in items)
+
+    def _explain(self, items: list):
+        heatmaps = gradcam(np.stack([item[2] for item in items]), [item[3] for item in items])
+        rows = []
+        for (user_id, image_hash, _, class_index, thumbnail), heatmap in zip(items, heatmaps):
+            image_bytes = encode_image(overlay(thumbnail, heatmap), HEATMAP_SIZE)
+            url = upload_drawing(self.client, image_bytes, name=image_hash, prefix=f"{HEATMAP_PREFIX}/{user_id}")
+            rows.append({"user_id": user_id, "image_hash": image_hash, "stage": classes[class_index], "path": url})
+        self.client.table("heatmaps").upsert(rows).execute()
+        logger.info("Stored %d heatmap(s)", len(rows))
+
+
+def get_explainer(client) -> ExplanationWorker:
+    """
+    Process-wide explanation worker shared by every Streamlit session.
+    """
+    global _explainer
+    if _explainer is None:
+        with _explainer_lock:
+            if _explainer is None:
+                _explainer = ExplanationWorker(client)
+    return _explainer
@@ -0,0 +1,200 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from utils.backends import BACKEND
+from utils.models import BACKBONES, EARLY_EXIT, default_models, fused_model_available, get_model, weights_digest
+from utils.preprocess import model_inputs
+
+ENSEMBLE = BACKBONES
+MAX_BATCH_SIZE = int(os.environ.get("DRAWEE_MAX_BATCH_SIZE", 16))
+
+# --- Confidence-gated early exit (DRAWEE_EARLY_EXIT=1) ---
+# The cheaper backbone runs first; a drawing it is sure about skips the other one.
+# Pick the thresholds with `python -m scripts.tune_early_exit`.
+EARLY_EXIT_MODEL = os.environ.get("DRAWEE_EARLY_EXIT_MODEL", "resnet")
+EARLY_EXIT_MIN_PROB = float(os.environ.get("DRAWEE_EARLY_EXIT_MIN_PROB", 0.90))
+EARLY_EXIT_MIN_MARGIN = float(os.environ.get("DRAWEE_EARLY_EXIT_MIN_MARGIN", 0.50))
+# Fraction of early exits that still run the full ensemble, to measure agreement
+EARLY_EXIT_AUDIT_RATE = float(os.environ.get("DRAWEE_EARLY_EXIT_AUDIT_RATE", 0.05))
+EARLY_EXIT_LOG_EVERY = 500
+
+# --- Embeddings ---
+# Penultimate-layer features of this backbone are the drawing's embedding (see utils.similarity).
+# It defaults to the early-exit model, which runs on every drawing in both serving modes.
+EMBEDDING_MODEL = os.environ.get("DRAWEE_EMBEDDING_MODEL", EARLY_EXIT_MODEL)
+
+logger = logging.getLogger(__name__)
+
+_early_exit_stats = {"images": 0, "early_exits": 0, "audited": 0, "agreed": 0}
+_early_exit_lock = threading.Lock()
+
+
+def predict_ensemble(batch: np.ndarray, timings: dict = None, features: dict = None):
+    """
+    Run each backbone once over a uint8 batch and average their class probabilities.
+    Returns (final_pred, per_model_preds). Stage durations in ms are added to `timings`;
+    if `features` is given, the batch's embeddings are stored in it under "embedding".
+    """
+    timings = {} if timings is None else timings
+    inputs = model_inputs(batch, ENSEMBLE)
+
+    if fused_model_available():
+        model = _timed(timings, "load.ensemble", get_model, "ensemble")
+        # One dispatch: both branches and the average run inside a single graph
+        outputs = _timed(timings, "predict.ensemble", model.predict, inputs[ENSEMBLE[0]], batch_size=len(batch), verbose=0)
+        if features is not None and f"{EMBEDDING_MODEL}_features" in outputs:
+            features["embedding"] = to_embedding(outputs[f"{EMBEDDING_MODEL}_features"])
+        return outputs["ensemble"], {name: outputs[name] for name in ENSEMBLE}
+
+    preds = {}
+    for name in ENSEMBLE:
+        try:
+            preds[name] = _predict_model(name, inputs[name], timings, features)
+        except Exception as e:
+            raise RuntimeError(f"{name} model prediction failed: {e}") from e
+
+    shapes = {name: pred.shape for name, pred in preds.items()}
+    if len(set(shapes.values())) != 1:
+        raise ValueError(f"Prediction shape mismatch: {shapes}")
+
+    final_pred = np.mean([preds[name] for name in ENSEMBLE], axis=0)
+    return final_pred, preds
+
+
+def to_embedding(features: np.ndarray) -> np.ndarray:
+    """
+    L2-normalized float16 rows from a batch of penultimate-layer features.
+    """
+    features = features.reshape(len(features), -1).astype(np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return (features / np.maximum(norms, 1e-12)).astype(np.float16)
+
+
+def _predict_model(name: str, x: np.ndarray, timings: dict, features: dict = None) -> np.ndarray:
+    """
+    One backbone's probabilities; for EMBEDDING_MODEL, also its embeddings into `features`.
+    """
+    model = _timed(timings, f"load.{name}", get_model, name)
+    if features is not None and name == EMBEDDING_MODEL and hasattr(model, "predict_with_features"):
+        feats, preds = _timed(timings, f"predict.{name}", model.predict_with_features, x, batch_size=len(x))
+        features["embedding"] = to_embedding(feats)
+        return preds
+    return _timed(timings, f"predict.{name}", model.predict, x, batch_size=len(x), verbose=0)
+
+
+def confident(pred: np.ndarray, min_prob: float, min_margin: float) -> np.ndarray:
+    """
+    Boolean mask of rows whose top probability and top-two margin both clear the thresholds.
+    """
+    top2 = np.sort(pred, axis=1)[:, -2:]
+    return (top2[:, 1] >= min_prob) & (top2[:, 1] - top2[:, 0] >= min_margin)
+
+
+def predict_adaptive(batch: np.ndarray, timings: dict = None, features: dict = None):
+    """
+    Early-exit ensemble: run EARLY_EXIT_MODEL over the batch, then the remaining backbones
+    only for the rows it isn't confident about (plus a small audit sample).
+    Same return value as predict_ensemble; skipped rows of the other models are NaN.
+    """
+    timings = {} if timings is None else timings
+    first = EARLY_EXIT_MODEL
+    rest = [name for name in ENSEMBLE if name != first]
+    inputs = model_inputs(batch, ENSEMBLE)
+
+    preds = {first: _predict_model(first, inputs[first], timings, features)}
+
+    exits = confident(preds[first], EARLY_EXIT_MIN_PROB, EARLY_EXIT_MIN_MARGIN)
+    audit = exits & (np.array([random.random() for _ in range(len(batch))]) < EARLY_EXIT_AUDIT_RATE)
+    run = ~exits | audit
+
+    final_pred = preds[first].copy()
+    if run.any():
+        for name in rest:
+            try:
+                # Only a subset of rows, so no embeddings from these
+                out = _predict_model(name, inputs[name][run], timings)
+            except Exception as e:
+                raise RuntimeError(f"{name} model prediction failed: {e}") from e
+            preds[name] = np.full(preds[first].shape, np.nan, dtype=out.dtype)
+            preds[name][run] = out
+        full = np.mean([preds[name] for name in ENSEMBLE], axis=0)
+        final_pred[~exits] = full[~exits]
+    else:
+        full = None
+
+    _record_early_exits(
+        len(batch), int(exits.sum()), int(audit.sum()),
+        int((full[audit].argmax(axis=1) == preds[first][audit].argmax(axis=1)).sum()) if audit.any() else 0,
+    )
+    return final_pred, preds
+
+
+def _record_early_exits(images: int, early_exits: int, audited: int, agreed: int):
+    with _early_exit_lock:
+        stats = _early_exit_stats
+        before = stats["images"]
+        stats["images"] += images
+        stats["early_exits"] += early_exits
+        stats["audited"] += audited
+        stats["agreed"] += agreed
+        if before // EARLY_EXIT_LOG_EVERY != stats["images"] // EARLY_EXIT_LOG_EVERY:
+            logger.info("Early exit: %s", early_exit_stats())
+
+
+def early_exit_stats() -> dict:
+    """
+    How often the early exit fired, and how often an audited early exit agreed with the full ensemble.
+    """
+    stats = dict(_early_exit_stats)
+    stats["early_exit_rate"] = stats["early_exits"] / stats["images"] if stats["images"] else 0.0
+    stats["agreement_rate"] = stats["agreed"] / stats["audited"] if stats["audited"] else None
+    return stats
+
+
+def predict_serving(batch: np.ndarray, timings: dict = None, features: dict = None):
+    """
+    The configured serving path: early-exit if DRAWEE_EARLY_EXIT=1, else the full ensemble.
+    """
+    return (predict_adaptive if EARLY_EXIT else predict_ensemble)(batch, timings, features)
+
+
+def serving_version() -> str:
+    """
+    What produces the serving predictions: backend, ensemble mode and the weights' digests.
+    Cached predictions made under another version are never reused.
+    """
+    if EARLY_EXIT:
+        mode = f"early-exit:{EARLY_EXIT_MODEL}:{EARLY_EXIT_MIN_PROB}:{EARLY_EXIT_MIN_MARGIN}"
+    else:
+        mode = "fused" if fused_model_available() else "average"
+    digests = ",".join(f"{name}={weights_digest(name)[:16]}" for name in default_models())
+    return f"{BACKEND}|{mode}|{digests}"
+
+
+def _timed(timings: dict, stage: str, fn, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[stage] = (time.perf_counter() - start) * 1000
+
+
+def predict_in_batches(batch: np.ndarray, max_batch_size: int = None, features: dict = None) -> np.ndarray:
+    """
+    Ensemble-predict a uint8 batch of any length, at most `max_batch_size` images per model call.
+    If `features` is given and every chunk produced embeddings, they are stored under "embedding".
+    """
+    max_batch_size = max_batch_size or MAX_BATCH_SIZE
+    chunks, embeddings = [], []
+    for start in range(0, len(batch), max_batch_size):
+        chunk_features = {}
+        chunks.append(predict_serving(batch[start:start + max_batch_size], features=chunk_features)[0])
+        embeddings.append(chunk_features.get("embedding"))
+    if features is not None and embeddings and all(e is not None for e in embeddings):
+        features["embedding"] = np.concatenate(embeddings, axis=0)
+    return np.concatenate(chunks, axis=0)
@@ -0,0 +1,259 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.artifacts import (
+    CACHE_DIR, MIRROR_DIR, artifact_digest, artifact_status, ensure_artifact, has_expected_digest, prefetch
+)
+from utils.backends import BACKEND, load_backend
+
+# --- Model artifacts ---
+MODEL_MAP = {
+    "resnet": {
+        "file_id": "1zx4ks1V2SPZem8oeqpNc2cYqN6l_z0oJ",
+        "filename": "drawee-resnet.h5"
+    },
+    "xception": {
+        "file_id": "1ibBelZfUwtr_GEP26mjStfJZYj3HeFtg",
+        "filename": "drawee-xception.h5"
+    },
+    # Built locally from the two backbones by scripts/build_ensemble.py
+    "ensemble": {
+        "file_id": None,
+        "filename": "drawee-ensemble.keras"
+    }
+}
+BACKBONES = ("resnet", "xception")
+
+MODEL_CACHE_DIR = CACHE_DIR
+# Confidence-gated serving (utils.inference.predict_adaptive) needs the backbones separately
+EARLY_EXIT = os.environ.get("DRAWEE_EARLY_EXIT", "") == "1"
+INPUT_SHAPE = (256, 256, 3)
+# Background fetch retries: doubled after every failure, up to the maximum
+FETCH_RETRY_BASE = 5.0
+FETCH_RETRY_MAX = 300.0
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registry: every Streamlit session in this server shares these entries.
+_registry = {}
+# One lock per model, so loading one never blocks another model or page code
+_load_locks = {}
+_load_locks_guard = threading.Lock()
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+# Latest load failure per model, until it loads
+_load_errors = {}
+
+
+def _rss_mb() -> float:
+    """
+    Current resident set size of this process in MB.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak RSS (KB on Linux, bytes on macOS); good enough as a fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def model_path(model_name: str) -> str:
+    model_info = MODEL_MAP.get(model_name)
+    if not model_info:
+        raise ValueError(f"Unknown model name: {model_name}")
+    return os.path.join(MODEL_CACHE_DIR, model_info["filename"])
+
+
+def fused_model_available() -> bool:
+    """
+    Whether the fused graph can serve. It is Keras-only (converted backends serve the two
+    backbones), and a copy that can't be verified, e.g. one built before sidecars were
+    written, or that failed verification is skipped in favour of the backbones.
+    """
+    filename = MODEL_MAP["ensemble"]["filename"]
+    if BACKEND != "keras" or not os.path.exists(model_path("ensemble")):
+        return False
+    status = artifact_status(filename)
+    if status == "ready":
+        return True
+    return not status.startswith("failed") and has_expected_digest(filename)
+
+
+def default_models() -> tuple:
+    """
+    The models serving needs: the fused ensemble if it has been built (and early exit is off),
+    else both backbones.
+    """
+    return ("ensemble",) if fused_model_available() and not EARLY_EXIT else BACKBONES
+
+
+def download_model(model_name: str) -> str:
+    """
+    Path of the verified weights for `model_name`, fetched into the cache if missing.
+    """
+    info = MODEL_MAP[model_name]
+    if not info["file_id"] and not os.path.exists(model_path(model_name)) and not MIRROR_DIR:
+        raise FileNotFoundError(f"{model_path(model_name)} not found; build it with scripts/build_ensemble.py")
+    return ensure_artifact(info["filename"], info["file_id"])
+
+
+def models_ready(model_names=None) -> bool:
+    """
+    True once the weights serving needs are cached and verified, so a request never waits on
+    a download, and none of them has failed to load.
+    """
+    return all(
+        artifact_status(MODEL_MAP[name]["filename"]) == "ready" and name not in _load_errors
+        for name in model_names or default_models()
+    )
+
+
+def models_error(model_names=None) -> str:
+    """
+    The latest fetch or load error for the models serving needs, or None while none has failed.
+    The background warm-up keeps retrying after a failure.
+    """
+    for name in model_names or default_models():
+        status = artifact_status(MODEL_MAP[name]["filename"])
+        if status.startswith("failed"):
+            return f"{name}: {status[len('failed: '):]}"
+        if name in _load_errors:
+            return f"{name}: could not be loaded: {_load_errors[name]}"
+    return None
+
+
+def weights_digest(model_name: str) -> str:
+    """
+    SHA-256 of the weights `model_name` is served from (verifying them first if needed).
+    """
+    filename = MODEL_MAP[model_name]["filename"]
+    if artifact_digest(filename) is None:
+        download_model(model_name)
+    return artifact_digest(filename)
+
+
+def _load_entry(model_name: str) -> dict:
+    path = download_model(model_name)
+
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    model = load_backend(path)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up with a dummy input so the first real request doesn't pay for graph tracing
+    start = time.perf_counter()
+    model.predict(np.zeros((1,) + INPUT_SHAPE, dtype=np.float32), verbose=0)
+    warmup_seconds = time.perf_counter() - start
+
+    entry = {
+        "name": model_name,
+        "model": model,
+        "path": path,
+        "backend": model.name,
+        "load_seconds": load_seconds,
+        "warmup_seconds": warmup_seconds,
+        "rss_mb": _rss_mb() - rss_before,
+    }
+    logger.info(
+        "Loaded %s (%s) in %.2fs (warm-up %.2fs, +%.0f MB RSS)",
+        model_name, model.name, load_seconds, warmup_seconds, entry["rss_mb"]
+    )
+    return entry
+
+
+def get_model_entry(model_name: str) -> dict:
+    """
+    Return the registry entry for a model, loading and warming it up on first use.
+    """
+    entry = _registry.get(model_name)
+    if entry is not None:
+        return entry
+
+    with _load_locks_guard:
+        lock = _load_locks.setdefault(model_name, threading.Lock())
+    with lock:
+        entry = _registry.get(model_name)
+        if entry is None:
+            try:
+                entry = _load_entry(model_name)
+            except Exception as e:
+                _load_errors[model_name] = str(e)
+                raise
+            _registry[model_name] = entry
+            _load_errors.pop(model_name, None)
+    return entry
+
+
+def get_model(model_name: str):
+    """
+    Return the shared, already-warm model instance for `model_name`.
+    """
+    return get_model_entry(model_name)["model"]
+
+
+def warm_up_models(model_names=None):
+    """
+    Fetch, load and warm up the given models (default: the ones serving needs).
+    """
+    # Import the rest of the inference stack too, so the first analysis finds it loaded
+    import utils.analysis  # noqa: F401
+
+    # Fetch every weight file first, so loading never waits on the network; keep
+    # retrying with backoff, since pages stay unable to analyze until this succeeds
+    delay = FETCH_RETRY_BASE
+    while True:
+        failures = prefetch({
+            MODEL_MAP[name]["filename"]: MODEL_MAP[name]["file_id"]
+            for name in model_names or default_models()
+        })
+        if not failures:
+            break
+        logger.warning("Model fetch failed, retrying in %.0fs: %s", delay, failures)
+        time.sleep(delay)
+        delay = min(FETCH_RETRY_MAX, delay * 2)
+
+    # A load failure (e.g. an incompatible file) is reported by models_error() and retried too
+    delay = FETCH_RETRY_BASE
+    while True:
+        failed = False
+        for name in model_names or default_models():
+            try:
+                get_model_entry(name)
+            except Exception:
+                logger.exception("Loading %s failed, retrying in %.0fs", name, delay)
+                failed = True
+        if not failed:
+            break
+        time.sleep(delay)
+        delay = min(FETCH_RETRY_MAX, delay * 2)
+
+
+def warm_up_in_background():
+    """
+    Start fetching and loading all models in a daemon thread (once per process).
+    """
+    global _warmup_thread
+    # Called on every rerun of every page: the fast path takes no lock
+    if _warmup_thread is not None:
+        return _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_up_models, name="drawee-model-warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def registry_stats() -> list:
+    """
+    Load time, warm-up time and resident memory for every loaded model.
+    """
+    return [
+        {k: v for k, v in entry.items() if k != "model"}
+        for entry in _registry.values()
+    ]
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.data import invalidate_user_cache
+from utils.deletion import remove_objects, storage_path_from_url
+from utils.similarity import add_to_index
+from utils.storage import UPLOAD_WORKERS, insert_results, upload_drawing
+
+SPOOL_DIR = os.environ.get("DRAWEE_SPOOL_DIR", "spool")
+MAX_ATTEMPTS = int(os.environ.get("DRAWEE_PERSIST_MAX_ATTEMPTS", 8))
+BACKOFF_BASE = 2.0       # seconds; doubled after every failed attempt
+BACKOFF_MAX = 300.0
+MAX_JOBS_PER_FLUSH = 50  # rows sent in one results upsert
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _write_atomic(path: str, data: bytes):
+    # Per-thread temp name: a job can be saved from an upload thread and the worker at once
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class WriteBehindQueue:
+    """
+    Persists analysis results in the background: the image upload and the results row are
+    spooled to disk first, then written to Supabase with retries and exponential backoff.
+    Jobs survive a process restart because the spool is re-read on start-up.
+    """
+
+    def __init__(self, client, spool_dir: str = SPOOL_DIR):
+        self.client = client
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Held around each results insert, so a cancelled job can't be inserted after cancel_child returns
+        self._insert_lock = threading.Lock()
+        # Ids in the flush under way, and those of them cancelled meanwhile (both reset after the flush)
+        self._flushing = set()
+        self._cancelled = set()
+
+        for filename in os.listdir(spool_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(spool_dir, filename)) as f:
+                    job = json.load(f)
+                self._jobs[job["id"]] = job
+
+        self._thread = threading.Thread(target=self._run, name="drawee-write-behind", daemon=True)
+        self._thread.start()
+
+    # --- Public API ---
+
+    def enqueue(self, row: dict, files: dict) -> str:
+        """
+        Spool one result row and its encoded images; returns the job (and row) id.
+        `files` maps a results column (e.g. image_path, thumbnail_path) to image bytes;
+        each column is filled in with the public URL once that upload succeeds.
+        """
+        job_id = str(uuid.uuid4())
+        for column, image_bytes in files.items():
+            _write_atomic(self._image_path(job_id, column), image_bytes)
+        job = {
+            "id": job_id,
+            "row": {**row, "id": job_id},
+            "files": list(files),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": 0.0,
+            "last_error": None,
+            "created_at": time.time(),
+        }
+        self._save(job)
+        self._wake.set()
+        return job_id
+
+    def status(self, user_id: str = None) -> dict:
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if user_id is None or j["row"].get("user_id") == user_id]
+        return {
+            "pending": sum(j["status"] == "pending" for j in jobs),
+            "failed": sum(j["status"] == "failed" for j in jobs),
+            "errors": [j["last_error"] for j in jobs if j["status"] == "failed"][:5],
+        }
+
+    def retry_failed(self, user_id: str = None):
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if j["status"] == "failed" and (user_id is None or j["row"].get("user_id") == user_id)]
+        for job in jobs:
+            job.update(status="pending", attempts=0, next_attempt_at=0.0)
+            self._save(job)
+        self._wake.set()
+
+    def cancel_child(self, user_id: str, child_id: str) -> int:
+        """
+        Drop the spooled jobs of a child that is being deleted, so they are never written;
+        images they already uploaded are removed again. Returns the number of dropped jobs.
+        """
+        with self._insert_lock:
+            with self._lock:
+                jobs = [
+                    j for j in self._jobs.values()
+                    if j["row"].get("user_id") == user_id and j["row"].get("child_id") == child_id
+                ]
+                # Only a job in the running flush can still be saved or inserted
+                self._cancelled.update(j["id"] for j in jobs if j["id"] in self._flushing)
+            for job in jobs:
+                self._done(job)
+        remove_objects(self.client, _uploaded_paths(jobs))
+        if jobs:
+            logger.info("Dropped %d pending result(s) of deleted child %s", len(jobs), child_id)
+        return len(jobs)
+
+    # --- Worker ---
+
+    def _run(self):
+        while True:
+            now = time.time()
+            with self._lock:
+                ready = [j for j in self._jobs.values() if j["status"] == "pending" and j["next_attempt_at"] <= now]
+                waiting = [j["next_attempt_at"] for j in self._jobs.values() if j["status"] == "pending" and j["next_attempt_at"] > now]
+
+            if ready:
+                batch = ready[:MAX_JOBS_PER_FLUSH]
+                with self._lock:
+                    self._flushing = {j["id"] for j in batch}
+                try:
+                    self._flush(batch)
+                finally:
+                    with self._lock:
+                        self._cancelled -= self._flushing
+                        self._flushing = set()
+                continue
+
+            timeout = max(0.0, min(waiting) - now) if waiting else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _flush(self, jobs: list):
+        def upload(job):
+            for column in job["files"]:
+                if job["row"].get(column):
+                    continue
+                name = job["id"] if column == "image_path" else f"{job['id']}_{column.replace('_path', '')}"
+                with open(self._image_path(job["id"], column), "rb") as f:
+                    job["row"][column] = upload_drawing(self.client, f.read(), name=name)
+                self._save(job)
+            return job
+
+        start = time.perf_counter()
+        uploaded = []
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+            for job, future in [(job, pool.submit(upload, job)) for job in jobs]:
+                try:
+                    uploaded.append(future.result())
+                except Exception as e:
+                    self._failed_attempt(job, f"upload: {e}")
+
+        upload_ms = (time.perf_counter() - start) * 1000
+        if not uploaded:
+            logger.info("Flush of %d job(s): uploads failed after %.0f ms", len(jobs), upload_ms)
+            return
+        start = time.perf_counter()
+        with self._insert_lock:
+            with self._lock:
+                cancelled = [job for job in uploaded if job["id"] in self._cancelled]
+            uploaded = [job for job in uploaded if job["id"] not in self._cancelled]
+            errors = self._insert(uploaded)
+        # Their child was deleted while these uploads ran
+        remove_objects(self.client, _uploaded_paths(cancelled))
+        for job in uploaded:
+            if job["id"] in errors:
+                self._failed_attempt(job, f"insert: {errors[job['id']]}")
+        uploaded = [job for job in uploaded if job["id"] not in errors]
+        if not uploaded:
+            return
+        insert_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            "Flushed %d/%d job(s): uploads %.0f ms, insert %.0f ms", len(uploaded), len(jobs), upload_ms, insert_ms
+        )
+
+        for job in uploaded:
+            self._done(job)
+        # Record counts and latest stages changed for these users; their similarity index grows in place
+        for user_id in {job["row"].get("user_id") for job in uploaded}:
+            invalidate_user_cache(user_id, "children_summary")
+            add_to_index(user_id, [job["row"] for job in uploaded if job["row"].get("user_id") == user_id])
+
+    def _insert(self, jobs: list) -> dict:
+        """
+        Insert the jobs' rows in one request; returns {job id: error} for the rows that failed.
+        If the batch is rejected, each row is retried alone, so one bad row (e.g. a foreign
+        key violation) only costs its own job an attempt, not every job flushed with it.
+        """
+        if not jobs:
+            return {}
+        try:
+            # Upsert on the client-generated id, so a retry after a lost response is harmless
+            insert_results(self.client, [job["row"] for job in jobs], upsert=True)
+            return {}
+        except Exception as e:
+            if len(jobs) == 1:
+                return {jobs[0]["id"]: e}
+            logger.warning("Insert of %d rows failed, retrying them one by one: %s", len(jobs), e)
+        errors = {}
+        for job in jobs:
+            try:
+                insert_results(self.client, [job["row"]], upsert=True)
+            except Exception as e:
+                errors[job["id"]] = e
+        return errors
+
+    def _failed_attempt(self, job: dict, error: str):
+        job["attempts"] += 1
+        job["last_error"] = error
+        if job["attempts"] >= MAX_ATTEMPTS:
+            job["status"] = "failed"
+            logger.error("Giving up on result %s after %d attempts: %s", job["id"], job["attempts"], error)
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (job["attempts"] - 1))
+            job["next_attempt_at"] = time.time() + delay
+            logger.warning("Persisting result %s failed (attempt %d, retry in %.0fs): %s", job["id"], job["attempts"], delay, error)
+        self._save(job)
+
+    def _done(self, job: dict):
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+        paths = [self._job_path(job["id"])] + [self._image_path(job["id"], c) for c in job["files"]]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # --- Spool files ---
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def _image_path(self, job_id: str, column: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.{column}.img")
+
+    def _save(self, job: dict):
+        with self._lock:
+            if job["id"] in self._cancelled:
+                return
+            self._jobs[job["id"]] = job
+            data = json.dumps(job).encode()
+        # The fsync happens outside the lock, which status() takes on every page rerun
+        _write_atomic(self._job_path(job["id"]), data)
+        with self._lock:
+            cancelled = job["id"] in self._cancelled
+        if cancelled:
+            # cancel_child ran during the write; don't leave the job to be resumed on restart
+            self._done(job)
+
+
+def _uploaded_paths(jobs: list) -> list:
+    return [storage_path_from_url(job["row"].get(column)) for job in jobs for column in job["files"]]
+
+
+def get_write_behind_queue(client) -> WriteBehindQueue:
+    """
+    Process-wide write-behind queue (one worker thread and spool per server).
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue(client)
+    return _queue
@@ -0,0 +1,212 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+from utils.inference import serving_version
+
+CACHE_SIZE = int(os.environ.get("DRAWEE_PHASH_CACHE_SIZE", 4096))
+MAX_DISTANCE = int(os.environ.get("DRAWEE_PHASH_MAX_DISTANCE", 4))
+# Optional persistent tier (SQLite file); disabled when unset
+CACHE_DB = os.environ.get("DRAWEE_PHASH_CACHE_DB")
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def phash(img: np.ndarray) -> int:
+    """
+    64-bit DCT perceptual hash of an RGB uint8 image; robust to re-encoding, scaling and
+    small lighting changes from re-photographing the same sheet.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class PredictionCache:
+    """
+    Bounded LRU of (probability vector, embedding) pairs keyed by perceptual hash, with
+    near-duplicate lookup within `max_distance` bits and an optional SQLite tier for exact
+    matches across restarts. The embedding is None when the models didn't provide one.
+
+    Every entry belongs to a scope: the serving version (backend, ensemble mode and weight
+    digests, see utils.inference.serving_version) plus the user. New weights or a different
+    mode never reuse old probabilities, and one user's drawings never match another's.
+    """
+
+    def __init__(self, capacity: int = CACHE_SIZE, max_distance: int = MAX_DISTANCE, db_path: str = CACHE_DB):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        # (scope, hash) -> (probs, embedding), in LRU order; scope -> its hashes, for near-duplicate search
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scoped_predictions ("
+                "scope TEXT, hash INTEGER, probs BLOB, embedding BLOB, PRIMARY KEY (scope, hash))"
+            )
+            self._db.commit()
+
+    def get(self, key: int, scope: str = ""):
+        """
+        (probs, embedding) for the drawing or a near-duplicate of it, or None.
+        """
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is not None:
+                self._entries.move_to_end((scope, key))
+                self.hits += 1
+                return entry
+
+            entry = self._nearest(key, scope)
+            if entry is not None:
+                self.near_hits += 1
+                return entry
+
+            entry = self._db_get(key, scope)
+            if entry is not None:
+                self._remember(key, scope, entry)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, key: int, probs: np.ndarray, embedding: np.ndarray = None, scope: str = ""):
+        probs = np.asarray(probs, dtype=np.float32)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float16)
+        with self._lock:
+            self._remember(key, scope, (probs, embedding))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO scoped_predictions VALUES (?, ?, ?, ?)",
+                    (scope, _signed(key), probs.tobytes(), embedding.tobytes() if embedding is not None else None)
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key: int, scope: str, entry: tuple):
+        self._entries[(scope, key)] = entry
+        self._entries.move_to_end((scope, key))
+        self._scopes.setdefault(scope, set()).add(key)
+        while len(self._entries) > self.capacity:
+            (old_scope, old_key), _ = self._entries.popitem(last=False)
+            scope_keys = self._scopes[old_scope]
+            scope_keys.discard(old_key)
+            if not scope_keys:
+                del self._scopes[old_scope]
+
+    def _nearest(self, key: int, scope: str):
+        scope_keys = self._scopes.get(scope)
+        if not self.max_distance or not scope_keys:
+            return None
+        keys = np.fromiter(scope_keys, dtype=np.uint64, count=len(scope_keys))
+        distances = _popcount(keys ^ np.uint64(key))
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None
+        match = (scope, int(keys[best]))
+        self._entries.move_to_end(match)
+        return self._entries[match]
+
+    def _db_get(self, key: int, scope: str):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT probs, embedding FROM scoped_predictions WHERE scope = ? AND hash = ?", (scope, _signed(key))
+        ).fetchone()
+        if row is None:
+            return None
+        probs, embedding = row
+        return (
+            np.frombuffer(probs, dtype=np.float32),
+            np.frombuffer(embedding, dtype=np.float16) if embedding is not None else None,
+        )
+
+
+def _signed(key: int) -> int:
+    # SQLite integers are signed 64-bit
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def get_prediction_cache() -> PredictionCache:
+    """
+    Process-wide prediction cache shared by every session.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PredictionCache()
+    return _cache
+
+
+def cached_predict(batch: np.ndarray, predict_fn, trace=None, features: dict = None, user_id: str = None,
+                   progress=None):
+    """
+    Predict a uint8 batch, reusing cached vectors for (near-)duplicates of `user_id`'s drawings.
+    Only the misses are sent to `predict_fn(misses, features)`, in one call. Returns (preds, hit_mask).
+    If `features` is given, its "embedding" is set to one entry per image: the predicted or
+    cached embedding, or None where the models didn't provide one. `progress("cache_lookup")`
+    is called once the cache has been checked.
+    """
+    cache = get_prediction_cache()
+    start = time.perf_counter()
+    scope = f"{serving_version()}|{user_id or ''}"
+    keys = [phash(img) for img in batch]
+    cached = [cache.get(key, scope) for key in keys]
+    hits = np.array([entry is not None for entry in cached])
+    if trace is not None:
+        trace.add("cache_lookup", (time.perf_counter() - start) * 1000, start)
+        trace.fields["cache_hit"] = bool(hits.all())
+    if progress is not None:
+        progress("cache_lookup")
+
+    preds = [entry[0] if entry is not None else None for entry in cached]
+    embeddings = [entry[1] if entry is not None else None for entry in cached]
+    misses = np.flatnonzero(~hits)
+    if len(misses):
+        fresh_features = {}
+        fresh = predict_fn(batch[misses], fresh_features)
+        fresh_embeddings = fresh_features.get("embedding")
+        for j, (i, probs) in enumerate(zip(misses, fresh)):
+            embeddings[i] = fresh_embeddings[j] if fresh_embeddings is not None else None
+            cache.put(keys[i], probs, embeddings[i], scope)
+            preds[i] = probs
+    if features is not None:
+        features["embedding"] = embeddings
+
+    logger.info("Prediction cache: %d/%d reused, %s", int(hits.sum()), len(batch), cache.stats())
+    return np.stack(preds), hits
@@ -0,0 +1,63 @@
+import numpy as np
+import cv2
+
+TARGET_SIZE = (256, 256)
+
+
+# --- Per-backbone normalization hooks ---
+# Both backbones were trained on pixels scaled to [0, 1]. If one of them is retrained
+# with a different scheme, register its own function here; backbones that share a
+# function also share a single input array.
+def scale_unit(batch: np.ndarray) -> np.ndarray:
+    """
+    Scale a uint8 batch to float32 in [0, 1] without an intermediate float64 copy.
+    """
+    out = np.empty(batch.shape, dtype=np.float32)
+    np.multiply(batch, np.float32(1.0 / 255.0), out=out, casting="unsafe")
+    return out
+
+
+NORMALIZERS = {
+    "resnet": scale_unit,
+    "xception": scale_unit,
+}
+
+
+def resize(img: np.ndarray) -> np.ndarray:
+    """
+    Resize an RGB uint8 image to the model input size (stays uint8).
+    """
+    if img.shape[:2] == TARGET_SIZE[::-1]:
+        return img
+    return cv2.resize(img, TARGET_SIZE)
+
+
+def stack_batch(images) -> np.ndarray:
+    """
+    Resize a list of RGB uint8 images into one contiguous uint8 batch array.
+    """
+    batch = np.empty((len(images), TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.uint8)
+    for i, img in enumerate(images):
+        batch[i] = resize(img)
+    return batch
+
+
+def model_inputs(batch: np.ndarray, backbones=None) -> dict:
+    """
+    Normalize a uint8 batch for each backbone, reusing the array when normalizers match.
+    """
+    inputs = {}
+    normalized = {}
+    for name in backbones or NORMALIZERS:
+        normalize = NORMALIZERS.get(name, scale_unit)
+        if normalize not in normalized:
+            normalized[normalize] = normalize(batch)
+        inputs[name] = normalized[normalize]
+    return inputs
+
+
+def preprocess(images, backbones=None) -> dict:
+    """
+    Resize once and normalize into float32 inputs keyed by backbone name.
+    """
+    return model_inputs(stack_batch(images), backbones)
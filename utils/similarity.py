@@ -0,0 +1,210 @@
+"""
+"Similar drawings" search over the embeddings stored with each result.
+
+Embeddings are L2-normalized float16 vectors (see utils.inference.to_embedding) kept in
+results.embedding. Each user's embeddings are loaded into an in-memory index once (cached
+like the other per-user reads in utils.data), newly persisted results are appended to it,
+and it is searched with one matrix-vector product.
+Collections of IVF_MIN_SIZE or more are also clustered into an inverted file, and a query
+then only scores the members of the IVF_PROBES nearest clusters.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utils.data import cached_read, peek_cached
+
+IVF_MIN_SIZE = int(os.environ.get("DRAWEE_IVF_MIN_SIZE", 20000))
+IVF_PROBES = int(os.environ.get("DRAWEE_IVF_PROBES", 8))
+IVF_ITERATIONS = 10
+# Rows scored per float32 block, so a search never makes a float32 copy of the whole index
+SCORE_CHUNK = 8192
+# Cosine similarity above which two drawings are flagged as the same submission
+DUPLICATE_SIMILARITY = float(os.environ.get("DRAWEE_DUPLICATE_SIMILARITY", 0.97))
+
+INDEX_COLUMNS = "id, child_id, child_name, created_at, image_path, thumbnail_path, prediction, embedding"
+RECORD_FIELDS = [column.strip() for column in INDEX_COLUMNS.split(",") if column.strip() != "embedding"]
+PAGE_SIZE = 1000
+
+
+def encode_embedding(embedding) -> str:
+    """
+    float16 bytes in PostgREST's bytea text form, or None when there is no embedding.
+    """
+    if embedding is None:
+        return None
+    return "\\x" + np.asarray(embedding, dtype=np.float16).tobytes().hex()
+
+
+def decode_embedding(value: str) -> np.ndarray:
+    return np.frombuffer(bytes.fromhex(value[2:]), dtype=np.float16)
+
+
+class EmbeddingIndex:
+    """
+    One user's drawings and their embeddings, searchable by cosine similarity.
+    Searches and appends from different sessions are serialized by a lock.
+    """
+
+    def __init__(self, records: list, vectors: np.ndarray):
+        self._lock = threading.Lock()
+        self.records = records
+        self._rows = {record["id"]: i for i, record in enumerate(records)}
+        # float16 as stored, half the memory of float32; rows are already unit length
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float16)
+        self.centroids = None
+        self.lists = None
+        if len(records) >= IVF_MIN_SIZE:
+            self._build_ivf()
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, records: list, vectors: np.ndarray):
+        """
+        Append records and their embeddings; ones already in the index are skipped. New rows
+        join their nearest existing cluster, and the inverted file is first built once the
+        index reaches IVF_MIN_SIZE.
+        """
+        with self._lock:
+            keep = [i for i, record in enumerate(records) if record["id"] not in self._rows]
+            if not keep:
+                return
+            vectors = np.asarray(vectors, dtype=np.float16)[keep]
+            start = len(self.records)
+            self.records = self.records + [records[i] for i in keep]
+            self._rows.update({record["id"]: start + i for i, record in enumerate(self.records[start:])})
+            self.vectors = np.ascontiguousarray(vectors if start == 0 else np.concatenate([self.vectors, vectors]))
+            if self.lists is not None:
+                assignment = np.argmax(vectors.astype(np.float32) @ self.centroids.T, axis=1)
+                for c in np.unique(assignment):
+                    self.lists[c] = np.concatenate([self.lists[c], start + np.flatnonzero(assignment == c)])
+            elif len(self.records) >= IVF_MIN_SIZE:
+                self._build_ivf()
+
+    def _build_ivf(self):
+        """
+        Spherical k-means into ~sqrt(N) clusters; each list holds its members' row numbers.
+        """
+        n_lists = int(np.sqrt(len(self.vectors)))
+        rng = np.random.default_rng(0)
+        centroids = self.vectors[rng.choice(len(self.vectors), n_lists, replace=False)].astype(np.float32)
+        for _ in range(IVF_ITERATIONS):
+            assignment = self._assign(centroids)
+            for c in range(n_lists):
+                members = self.vectors[assignment == c]
+                if len(members):
+                    mean = members.sum(axis=0, dtype=np.float32)
+                    centroids[c] = mean / max(np.linalg.norm(mean), 1e-12)
+        assignment = self._assign(centroids)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+
+    def _assign(self, centroids: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(self.vectors[start:start + SCORE_CHUNK].astype(np.float32) @ centroids.T, axis=1)
+            for start in range(0, len(self.vectors), SCORE_CHUNK)
+        ])
+
+    def _scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of the given rows (all rows if None) to a float32 query.
+        """
+        n = len(self.vectors) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_CHUNK):
+            block = self.vectors[start:start + SCORE_CHUNK] if rows is None else self.vectors[rows[start:start + SCORE_CHUNK]]
+            scores[start:start + SCORE_CHUNK] = block.astype(np.float32) @ query
+        return scores
+
+    def search(self, query: np.ndarray, k: int = 5, exclude: str = None) -> list:
+        """
+        The `k` most similar records as [(record, similarity)], best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            return self._search(query, k, exclude)
+
+    def _search(self, query: np.ndarray, k: int, exclude: str) -> list:
+        if self.lists is not None:
+            probes = np.argsort(self.centroids @ query)[-IVF_PROBES:]
+            candidates = np.concatenate([self.lists[c] for c in probes])
+            scores = self._scores(candidates, query)
+        else:
+            candidates = None
+            scores = self._scores(None, query)
+
+        n = min(k + 1, len(scores))
+        if n == 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            record = self.records[candidates[i] if candidates is not None else i]
+            if record["id"] != exclude:
+                results.append((record, float(scores[i])))
+        return results[:k]
+
+    def similar_to(self, record_id: str, k: int = 5) -> list:
+        """
+        Drawings most similar to one of the user's own records; empty if it has no embedding.
+        """
+        with self._lock:
+            row = self._rows.get(record_id)
+            if row is None:
+                return []
+            return self._search(self.vectors[row].astype(np.float32), k, exclude=record_id)
+
+
+def _load_index(client, user_id: str) -> EmbeddingIndex:
+    records, vectors, start = [], [], 0
+    while True:
+        rows = (
+            client.table("results").select(INDEX_COLUMNS)
+            .eq("user_id", user_id).not_.is_("embedding", "null")
+            .order("id").range(start, start + PAGE_SIZE - 1)
+            .execute().data or []
+        )
+        for row in rows:
+            vectors.append(decode_embedding(row.pop("embedding")))
+            records.append(row)
+        if len(rows) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+    if not vectors:
+        return EmbeddingIndex([], np.empty((0, 0), dtype=np.float16))
+    return EmbeddingIndex(records, np.stack(vectors))
+
+
+def get_embedding_index(client, user_id: str) -> EmbeddingIndex:
+    """
+    The user's embedding index, cached; dropped by invalidate_user_cache(user_id, "embeddings").
+    """
+    return cached_read(user_id, "embeddings", lambda: _load_index(client, user_id))
+
+
+def add_to_index(user_id: str, rows: list):
+    """
+    Append newly inserted results rows (with encoded embeddings) to the user's index, if it
+    is cached; otherwise the next search loads them from the database anyway.
+    """
+    index = peek_cached(user_id, "embeddings")
+    rows = [row for row in rows if row.get("embedding")]
+    if index is None or not rows:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    records = [{**{field: row.get(field) for field in RECORD_FIELDS}, "created_at": row.get("created_at") or now} for row in rows]
+    index.add(records, np.stack([decode_embedding(row["embedding"]) for row in rows]))
+
+
+def similar_drawings(client, user_id: str, record_id: str, k: int = 5) -> list:
+    """
+    [(record, similarity, is_duplicate)] across all of the user's children, best first.
+    """
+    return [
+        (record, similarity, similarity >= DUPLICATE_SIMILARITY)
+        for record, similarity in get_embedding_index(client, user_id).similar_to(record_id, k)
+    ]
@@ -0,0 +1,86 @@
+import io
+import os
+import uuid
+
+BUCKET = "drawings"
+UPLOAD_PREFIX = "user_uploads"
+UPLOAD_WORKERS = 8
+
+# Stored originals are size-capped and lossy-compressed; drawings don't need lossless PNG
+IMAGE_FORMAT = os.environ.get("DRAWEE_IMAGE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+IMAGE_QUALITY = 85
+MAX_IMAGE_SIDE = int(os.environ.get("DRAWEE_MAX_IMAGE_SIDE", 1600))
+# Uploads with more pixels than this are rejected from their header, before decoding
+MAX_IMAGE_PIXELS = int(os.environ.get("DRAWEE_MAX_IMAGE_PIXELS", 50_000_000))
+# Pre-generated thumbnails: results column -> longest side in pixels
+THUMBNAIL_SIZES = {"thumbnail_path": 320}
+
+_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def decode_image(fp, max_side: int = MAX_IMAGE_SIDE):
+    """
+    Decode an upload into an upright RGB PIL image whose longest side is at most `max_side`.
+    JPEGs are decoded at a reduced DCT scale (1/2 to 1/8), so a phone photo's
+    full-resolution pixels are never held in memory.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(fp) as im:
+        w, h = im.size
+        if w * h > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image is too large ({w}x{h}); the limit is {MAX_IMAGE_PIXELS:,} pixels")
+        if max(w, h) > max_side:
+            ratio = max_side / max(w, h)
+            # No-op for formats other than JPEG
+            im.draft("RGB", (max(1, int(w * ratio)), max(1, int(h * ratio))))
+            im.thumbnail((max_side, max_side))
+        return ImageOps.exif_transpose(im).convert("RGB")
+
+
+def encode_image(im, max_side: int) -> bytes:
+    """
+    Encode a PIL image in IMAGE_FORMAT, downscaled so its longest side is at most `max_side`.
+    """
+    if max(im.size) > max_side:
+        im = im.copy()
+        im.thumbnail((max_side, max_side))
+    image_bytes = io.BytesIO()
+    im.save(image_bytes, format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+    return image_bytes.getvalue()
+
+
+def encode_drawing(im) -> dict:
+    """
+    Encoded original plus thumbnails, keyed by the results column that stores each URL.
+    """
+    files = {"image_path": encode_image(im, MAX_IMAGE_SIDE)}
+    for column, size in THUMBNAIL_SIZES.items():
+        files[column] = encode_image(im, size)
+    return files
+
+
+def upload_drawing(client, image_bytes: bytes, name: str = None, prefix: str = UPLOAD_PREFIX) -> str:
+    """
+    Upload one encoded drawing and return its public URL.
+    Passing a fixed `name` makes the upload idempotent, so it can be retried safely.
+    """
+    storage_path = f"{prefix}/{name or uuid.uuid4().hex}.{_EXTENSIONS[IMAGE_FORMAT]}"
+    file_options = {"content-type": _CONTENT_TYPES[IMAGE_FORMAT], "cache-control": "31536000"}
+    if name:
+        file_options["upsert"] = "true"
+    bucket = client.storage.from_(BUCKET)
+    bucket.upload(storage_path, image_bytes, file_options=file_options)
+    return bucket.get_public_url(storage_path)
+
+
+def insert_results(client, rows: list, upsert: bool = False):
+    """
+    Insert all result rows in a single request (upsert on id for retried writes).
+    """
+    if not rows:
+        return None
+    if upsert:
+        return client.table("results").upsert(rows).execute()
+    return client.table("results").insert(rows).execute()
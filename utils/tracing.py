@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Show the per-request timing panel in the result dialog (also enabled by ?debug=1)
+DEBUG_PANEL = os.environ.get("DRAWEE_DEBUG", "") == "1"
+
+logger = logging.getLogger("drawee.trace")
+if not logger.handlers:
+    # One JSON object per line, independent of Streamlit's own log format
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Trace:
+    """
+    Latency trace for one analysis request: a list of named spans emitted as one JSON record.
+    """
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.request_id = uuid.uuid4().hex
+        self.fields = fields
+        self.spans = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000, start)
+
+    def add(self, stage: str, duration_ms: float, start: float = None):
+        """
+        Record a span measured elsewhere (e.g. by the inference worker thread).
+        """
+        offset = (start - self._start) * 1000 if start is not None else None
+        with self._lock:
+            self.spans.append({"stage": stage, "ms": round(duration_ms, 2), "offset_ms": offset and round(offset, 2)})
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "trace": self.name,
+                "request_id": self.request_id,
+                "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+                "spans": list(self.spans),
+                **self.fields,
+            }
+
+    def emit(self) -> dict:
+        record = self.to_dict()
+        logger.info(json.dumps(record, default=str))
+        return record